@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+
+#    This file is part of the Better Python Console Plugin for Gedit
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+"""Benchmarks of the console hot paths.
+
+    python benchmarks/consolebench.py [--gtk] [--threaded] [--label NAME]
+    xvfb-run python benchmarks/consolebench.py --gtk
+
+measures:
+
+  output       lines/s written through the console stdout, flush included
+  paste        completeness checking of a large paste, lines/s
+  execute      overhead of one typed statement, from push to prompt
+  complete     latency of one Tab completion, after a command has run
+  highlight    lines/s through the syntax highlighter
+  startup      Run Module to first prompt, new console process
+
+The headless console is used unless --gtk is given, which needs a display
+(or Xvfb). Results are saved as JSON in benchmarks/results, and --compare
+prints the ratios against a previous result file.
+"""
+
+import os
+import sys
+import json
+import time
+import tempfile
+import optparse
+import platform
+import subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CONSOLE_DIR = os.path.join(os.path.dirname(HERE), 'betterpythonconsole')
+sys.path.insert(0, CONSOLE_DIR)
+
+import consolecore
+import consolehistory
+
+
+class NullSink:
+    """Output stream dropping everything, so only the console is timed."""
+
+    def write(self, s):
+        pass
+
+    def flush(self):
+        pass
+
+
+def make_console(gtk, threaded):
+    """Return a console and a function running its main loop until it is
+    idle. The history is kept in memory so the real one is left alone."""
+    if gtk:
+        import consoleinterface
+        from gi.repository import Gtk
+        window = consoleinterface.ConsoleWindow(
+            consolecore.new_namespace(), threaded=threaded,
+            close_handler=lambda window: None)
+        console = window.console
+
+        def settle():
+            while console.running or Gtk.events_pending():
+                Gtk.main_iteration()
+    else:
+        console = consolecore.HeadlessConsole(
+            consolecore.new_namespace(), sink=NullSink(), threaded=threaded)
+
+        def settle():
+            while console.running:
+                console.wait_events()
+            console.process_events()
+    console.history.store = consolehistory.HistoryStore()
+    return console, settle
+
+
+def best(function, repeat):
+    """Return the shortest of repeat timings of function."""
+    timings = []
+    for i in range(repeat):
+        start = time.time()
+        function()
+        timings.append(time.time() - start)
+    return min(timings)
+
+
+def bench_output(console, settle, repeat, lines=100000):
+    """Lines/s written to the console stdout and flushed."""
+    line = 'output line of a running command, about sixty characters\n'
+
+    def write():
+        out = console.stdout
+        for i in range(lines):
+            out.write(line)
+        console.flush_output()
+        settle()
+    return lines / best(write, repeat)
+
+
+def bench_paste(console, settle, repeat, lines=20000):
+    """Lines/s going through the completeness checker, for a paste of
+    lines lines of code."""
+    block = ['def function_%d(a, b=(1, 2,',
+             '                  3)):',
+             '    """A docstring with a \' quote',
+             '    and a second line."""',
+             '    return {"a": [a, b],  # comment (',
+             '            "b": \'\\\'\'}',
+             '']
+    paste = []
+    while len(paste) < lines:
+        n = len(paste)
+        paste.extend([l.replace('%d', str(n)) if '%d' in l else l
+                      for l in block])
+    paste = paste[:lines]
+
+    def check():
+        checker = consolecore.StatementChecker()
+        for l in paste:
+            checker.push(l)
+        console.is_balanced('\n'.join(paste))
+    return 2 * lines / best(check, repeat)
+
+
+def bench_execute(console, settle, repeat, statements=2000):
+    """Seconds per statement, from push to the next prompt."""
+    def execute():
+        for i in range(statements):
+            console.push(['x = %d' % i])
+            settle()
+    return best(execute, repeat) / statements
+
+
+def bench_complete(console, settle, repeat):
+    """Seconds per completion of a name or attribute chain, each one
+    following a command as when typing."""
+    console.push(['import os, sys, re, socket, decimal, collections'])
+    settle()
+    lines = ['os.path.jo', 'os.', 'sys.std', 'socket.AF_', 'decimal.Dec',
+             'collections.OrderedDict.', 'so', 'print(re.com', 'x = sys.']
+
+    def complete():
+        for line in lines:
+            console.completer.invalidate()
+            console.completions(line)
+    return best(complete, repeat * 10) / len(lines)
+
+
+def bench_highlight(console, settle, repeat, lines=20000):
+    """Lines/s split into highlighted spans, as when typing or pasting."""
+    import highlight
+    source = ['@decorator(arg)',
+              'def function(a, b=None, *args, **kwargs):',
+              '    """A docstring',
+              '    on two lines."""',
+              '    result = [len(x) for x in a if x is not None]  # comment',
+              '    return {"key": r\'raw\', \'other\': 0x1f} or b"bytes"',
+              '']
+
+    def run():
+        state = None
+        for i in range(lines):
+            state = highlight.highlight(source[i % len(source)], state)[1]
+    return lines / best(run, repeat)
+
+
+def bench_startup(gtk, threaded, repeat):
+    """Seconds from launching a console on a module to its first prompt."""
+    script = gtk and 'consoleinterface.py' or 'consolecore.py'
+    fd, module = tempfile.mkstemp(suffix='.py')
+    os.write(fd, b'import os\nvalue = sum(range(1000))\nprint(value)\n')
+    os.close(fd)
+    command = [sys.executable, os.path.join(CONSOLE_DIR, script),
+               '--exit-at-prompt',
+               threaded and '--threaded' or '--no-threaded', module]
+    devnull = open(os.devnull, 'w+')
+    try:
+        def launch():
+            subprocess.check_call(command, stdin=devnull, stdout=devnull)
+        return best(launch, repeat)
+    finally:
+        devnull.close()
+        os.unlink(module)
+
+
+BENCHMARKS = [
+    ('output', 'lines/s', bench_output),
+    ('paste', 'lines/s', bench_paste),
+    ('execute', 's/stmt', bench_execute),
+    ('complete', 's/tab', bench_complete),
+    ('highlight', 'lines/s', bench_highlight),
+]
+
+
+def compare(results, path):
+    """Print the ratios of results to the ones saved in path."""
+    f = open(path)
+    try:
+        old = json.load(f)['results']
+    finally:
+        f.close()
+    print('\nCompared to %s:' % path)
+    for name, result in sorted(results.items()):
+        if name not in old:
+            continue
+        ratio = result['value'] / old[name]['value']
+        # Higher is better for rates, lower for durations
+        if not result['unit'].endswith('/s'):
+            ratio = 1 / ratio
+        print('  %-10s %6.2fx %s' % (name, ratio,
+                                     ratio >= 1 and 'faster' or 'slower'))
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--gtk', action='store_true', default=False,
+                      help='benchmark the GTK console (needs a display)')
+    parser.add_option('--threaded', action='store_true', default=False,
+                      help='run commands on a worker thread')
+    parser.add_option('--repeat', type='int', default=3,
+                      help='runs of each benchmark, the best one is kept')
+    parser.add_option('--only', default='',
+                      help='comma separated benchmarks to run')
+    parser.add_option('--label', default='',
+                      help='name of the results file (default: a date)')
+    parser.add_option('--compare', metavar='FILE',
+                      help='compare with a previous results file')
+    options, args = parser.parse_args()
+    only = [name for name in options.only.split(',') if name]
+
+    console, settle = make_console(options.gtk, options.threaded)
+    results = {}
+    for name, unit, function in BENCHMARKS:
+        if only and name not in only:
+            continue
+        value = function(console, settle, options.repeat)
+        results[name] = {'value': value, 'unit': unit}
+        print('%-10s %14.6g %s' % (name, value, unit))
+    if not only or 'startup' in only:
+        value = bench_startup(options.gtk, options.threaded, options.repeat)
+        results['startup'] = {'value': value, 'unit': 's'}
+        print('%-10s %14.6g %s' % ('startup', value, 's'))
+
+    frontend = options.gtk and 'gtk' or 'headless'
+    mode = options.threaded and 'threaded' or 'main-thread'
+    label = options.label or '%s-%s-%s' % (
+        time.strftime('%Y%m%d-%H%M%S'), frontend, mode)
+    directory = os.path.join(HERE, 'results')
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    path = os.path.join(directory, label + '.json')
+    f = open(path, 'w')
+    try:
+        json.dump({'label': label, 'time': time.time(),
+                   'python': platform.python_version(),
+                   'frontend': frontend, 'mode': mode,
+                   'results': results}, f, indent=1, sort_keys=True)
+    finally:
+        f.close()
+    print('Results saved to %s' % path)
+    if options.compare:
+        compare(results, options.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+
+#    This file is part of the Better Python Console Plugin for Gedit
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+"""An asyncio event loop run in steps from the console main loop.
+
+The loop lives as long as the console: tasks started by a command keep
+running between prompts, and a command using top level await runs as a
+task while the window stays responsive. The console main loop runs one
+iteration of the asyncio loop at a time, right away when callbacks are
+ready, at the next timer otherwise, and every POLL_INTERVAL to poll I/O.
+While the steps find no I/O ready, e.g. a server waiting for clients, the
+interval doubles up to MAX_POLL_INTERVAL, and it is back to POLL_INTERVAL
+once a step does work or a command runs. Nothing is polled once the loop
+has no work left.
+
+Only available with Python 3, top level await needs Python 3.8.
+"""
+
+import asyncio
+import warnings
+
+# Seconds between two steps while the loop waits for I/O
+POLL_INTERVAL = 0.01
+
+# Longest wait between two steps once the loop waits for I/O in vain
+MAX_POLL_INTERVAL = 0.25
+
+
+def current_loop():
+    """Return the event loop set for this thread, or a new one."""
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', DeprecationWarning)
+        try:
+            loop = asyncio.get_event_loop_policy().get_event_loop()
+        except RuntimeError:
+            loop = None
+    if loop is None or loop.is_closed() or loop.is_running():
+        loop = asyncio.new_event_loop()
+    return loop
+
+
+class LoopDriver:
+    """Run the asyncio loop of a console in steps from its main loop.
+
+    The console provides post and call_later to schedule the steps, and
+    can_step and swap_io: steps only happen between commands or while a
+    command awaits, with the console streams in place.
+    """
+
+    def __init__(self, console):
+        self.console = console
+        self.loop = current_loop()
+        self.scheduled = False
+        self.stepping = False
+        self.poll_interval = POLL_INTERVAL
+        self.attach()
+
+    def attach(self):
+        """Make the loop the current one again (asyncio.run unsets it)
+        and step it if it has work, after a command."""
+        self.make_current()
+        self.poll_interval = POLL_INTERVAL
+        self.schedule()
+
+    def make_current(self):
+        """Make the loop the current one of the calling thread, so that
+        the worker thread of a command creates its tasks on it."""
+        if not self.loop.is_closed():
+            asyncio.set_event_loop(self.loop)
+
+    def has_work(self):
+        """Tell whether the loop has callbacks, timers, tasks or I/O."""
+        loop = self.loop
+        if loop.is_closed():
+            return False
+        if getattr(loop, '_ready', None) or getattr(loop, '_scheduled', None):
+            return True
+        if asyncio.all_tasks(loop):
+            return True
+        selector = getattr(loop, '_selector', None)
+        # The loop always watches its own wakeup pipe
+        return selector is not None and len(selector.get_map()) > 1
+
+    def has_events(self):
+        """Tell whether a step would run callbacks or handle I/O now."""
+        if getattr(self.loop, '_ready', None):
+            return True
+        selector = getattr(self.loop, '_selector', None)
+        if selector is None:
+            return True
+        try:
+            return bool(selector.select(0))
+        except (OSError, ValueError):
+            return True
+
+    def next_delay(self):
+        """Return the seconds until the next step is due."""
+        if getattr(self.loop, '_ready', None):
+            return 0
+        delay = self.poll_interval
+        timers = getattr(self.loop, '_scheduled', None)
+        if timers:
+            delay = min(delay, max(timers[0].when() - self.loop.time(), 0))
+        return delay
+
+    def schedule(self):
+        """Schedule the next step, unless there is nothing to do."""
+        if self.scheduled or not self.has_work():
+            return
+        self.scheduled = True
+        delay = self.next_delay()
+        if delay:
+            self.console.call_later(delay, self.step)
+        else:
+            self.console.post(self.step)
+
+    def step(self):
+        """Run one iteration of the loop, the callbacks ready and the I/O
+        ready now, then schedule the next one."""
+        self.scheduled = False
+        if self.loop.is_closed() or self.stepping:
+            # A nested main loop, e.g. input() in a task, steps it after
+            return False
+        if not self.console.can_step():
+            # A command is running, execute_done steps it after
+            return False
+        if self.has_events():
+            self.poll_interval = POLL_INTERVAL
+        else:
+            self.poll_interval = min(self.poll_interval * 2,
+                                     MAX_POLL_INTERVAL)
+        self.stepping = True
+        self.console.swap_io()
+        try:
+            try:
+                self.loop.call_soon(self.loop.stop)
+                self.loop.run_forever()
+            except (KeyboardInterrupt, SystemExit):
+                # Left in the task they end as well, which reports them
+                pass
+        finally:
+            self.console.swap_io()
+            self.stepping = False
+        self.schedule()
+        return False
+
+    def run_task(self, coro, callback):
+        """Run coro as a task, callback is called with it once done."""
+        task = self.loop.create_task(coro)
+        task.add_done_callback(callback)
+        self.poll_interval = POLL_INTERVAL
+        self.schedule()
+        return task
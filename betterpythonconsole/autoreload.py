@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+
+#    This file is part of the Better Python Console Plugin for Gedit
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+"""Reload of the user modules edited while a console is open.
+
+Only the modules imported from outside the Python installation and its
+site-packages are watched. Which modules these are, and the source file
+of each, is worked out once per module and kept in an index, so a check
+before a command costs one stat() per user module. Changed modules are
+reloaded in dependency order: a module is reloaded after the changed
+modules it imports, as found in the source of the changed modules.
+"""
+
+import os
+import ast
+import sys
+import site
+import sysconfig
+
+try:
+    from importlib import reload
+except ImportError:
+    reload = reload
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Files of the import machinery run by a reload
+MACHINERY = ('<frozen importlib',)
+if 'importlib' in sys.modules:
+    MACHINERY = MACHINERY + (
+        os.path.join(os.path.dirname(sys.modules['importlib'].__file__), ''),)
+
+
+def system_dirs():
+    """Return the directories of the modules which are never reloaded:
+    the Python installation, the site-packages and dist-packages
+    directories (the user's included) and the console itself."""
+    paths = [HERE, sys.prefix, sys.exec_prefix]
+    for name in ('stdlib', 'platstdlib', 'purelib', 'platlib'):
+        paths.append(sysconfig.get_paths().get(name))
+    # Both are missing from the site module of virtualenv's Python 2
+    if hasattr(site, 'getsitepackages'):
+        paths.extend(site.getsitepackages())
+    if hasattr(site, 'getusersitepackages'):
+        paths.append(site.getusersitepackages())
+    dirs = set([os.path.realpath(path) for path in paths if path])
+    return tuple([os.path.join(path, '') for path in dirs])
+
+
+def source_file(module):
+    """Return the source file of a user module, or None for the modules
+    which can not be reloaded from source."""
+    filename = getattr(module, '__file__', None)
+    if not filename:
+        return None
+    base, ext = os.path.splitext(filename)
+    if ext in ('.pyc', '.pyo'):
+        filename = base + '.py'
+    elif ext != '.py':
+        return None
+    return os.path.realpath(filename)
+
+
+def stamp(filename):
+    """Return what tells a version of filename, or None if it is gone."""
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+    return st.st_mtime, st.st_size
+
+
+def dedupe_path(path):
+    """Remove the repeated entries of a list like sys.path in place,
+    keeping the first of each."""
+    seen = set()
+    kept = []
+    for entry in path:
+        if entry not in seen:
+            seen.add(entry)
+            kept.append(entry)
+    path[:] = kept
+
+
+class ModuleReloader:
+    """Index of the user modules and of the version of their source."""
+
+    def __init__(self):
+        self.system = system_dirs()
+        # name -> (module, filename, stamp) of the user modules
+        self.index = {}
+        # Names of sys.modules already classified
+        self.known = set()
+
+    def update_index(self):
+        """Add the modules imported since the last check to the index."""
+        if len(self.known) == len(sys.modules):
+            return
+        names = set(sys.modules)
+        for name in names - self.known:
+            module = sys.modules[name]
+            if module is None or name == '__main__':
+                continue
+            filename = source_file(module)
+            if filename is None or filename.startswith(self.system):
+                continue
+            self.index[name] = (module, filename, stamp(filename))
+        self.known = names
+        for name in list(self.index):
+            if sys.modules.get(name) is not self.index[name][0]:
+                del self.index[name]
+
+    def changed(self):
+        """Return the names of the user modules whose source changed since
+        they were loaded, in the order they should be reloaded."""
+        self.update_index()
+        changed = []
+        for name, (module, filename, loaded) in self.index.items():
+            current = stamp(filename)
+            if current is not None and current != loaded:
+                changed.append(name)
+        return dependency_order(changed, self.index)
+
+    def reload(self, name):
+        """Reload a module, recording its new version even when it fails
+        so it is only retried once it changes again."""
+        module, filename, loaded = self.index[name]
+        self.index[name] = (module, filename, stamp(filename))
+        reload(module)
+
+
+def reload_traceback(tb):
+    """Return the part of the traceback of a failed reload from the
+    reloaded module on, without the reloader and importlib frames."""
+    method = ModuleReloader.reload
+    ours = getattr(method, '__func__', method).__code__
+    while tb is not None:
+        code = tb.tb_frame.f_code
+        if code is not ours and not code.co_filename.startswith(MACHINERY):
+            break
+        tb = tb.tb_next
+    return tb
+
+
+def imports(name, filename):
+    """Return the names of the modules imported by the source of module
+    name, or of the modules their names could be imported from."""
+    try:
+        f = open(filename, 'rb')
+        try:
+            tree = ast.parse(f.read(), filename)
+        finally:
+            f.close()
+    except (IOError, OSError, SyntaxError, ValueError):
+        return set()
+    package = name.rsplit('.', 1)[0] if '.' in name else ''
+    if os.path.splitext(os.path.basename(filename))[0] == '__init__':
+        package = name
+    found = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            found.update([alias.name for alias in node.names])
+        elif isinstance(node, ast.ImportFrom):
+            base = node.module or ''
+            if node.level:
+                parts = package.split('.')
+                parts = parts[:len(parts) - node.level + 1]
+                base = '.'.join([part for part in parts + [base] if part])
+            found.add(base)
+            found.update([base + '.' + alias.name for alias in node.names])
+    return found
+
+
+def dependency_order(names, index):
+    """Sort names so that each module comes after the ones it imports."""
+    names = sorted(names)
+    pending = set(names)
+    deps = dict([(name, (imports(name, index[name][1]) & pending) -
+                  set([name])) for name in names])
+    ordered = []
+
+    def visit(name, path):
+        if name not in pending:
+            return
+        if name in path:
+            return
+        path.add(name)
+        for dep in sorted(deps[name]):
+            visit(dep, path)
+        pending.discard(name)
+        ordered.append(name)
+
+    for name in names:
+        visit(name, set())
+    return ordered
@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+
+#    This file is part of the Better Python Console Plugin for Gedit
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+"""Compiled code caches for the console.
+
+Console input is parsed once and compiled in 'single' mode, the way the
+interactive interpreter does it, and the code objects are kept in a
+bounded LRU so recalled commands skip compilation.
+
+Modules run with Run Module are compiled with their real filename and
+kept both in memory and on disk, so unchanged modules are not parsed
+again on the next run or in the next console.
+"""
+
+import os
+import re
+import sys
+import ast
+import marshal
+import hashlib
+import linecache
+from collections import OrderedDict, deque
+
+# A line starting a new cell in cell mode
+CELL_RE = re.compile(br'^#\s*%%')
+
+# Compile flag allowing await at the top level, from Python 3.8
+TOP_LEVEL_AWAIT = getattr(ast, 'PyCF_ALLOW_TOP_LEVEL_AWAIT', 0)
+
+# Flag of the code objects of coroutines (inspect.CO_COROUTINE), which
+# commands using top level await compile to
+CO_COROUTINE = 0x0080
+
+# Evicted commands whose source is still kept in linecache, for the
+# tracebacks which may still point at them
+RETIRED_COMMANDS = 32
+
+
+def compile_interactive(source, filename, flags=0):
+    """Compile source as interactive input in a single parse.
+
+    Unlike compile(..., 'single'), source may hold several statements;
+    each expression statement at the top level has its value displayed
+    through sys.displayhook."""
+    tree = compile(source, filename, 'exec', ast.PyCF_ONLY_AST | flags)
+    return compile(ast.Interactive(tree.body), filename, 'single', flags)
+
+
+class CommandCache:
+    """Bounded LRU of compiled console commands, keyed by source text.
+
+    Each compiled command gets its own '<console-N>' filename, registered
+    in linecache so tracebacks can show its source. The source is removed
+    from linecache RETIRED_COMMANDS evictions after the command."""
+
+    def __init__(self, size=256):
+        self.size = size
+        self.entries = OrderedDict()
+        self.count = 0
+        self.retired = deque()
+
+    def compile(self, source, flags=0):
+        """Return the code object for source, compiling it on a miss."""
+        key = (source, flags)
+        code = self.entries.pop(key, None)
+        if code is None:
+            filename = '<console-%d>' % (self.count + 1)
+            code = compile_interactive(source, filename, flags)
+            self.count += 1
+            linecache.cache[filename] = (
+                len(source), None, source.splitlines(True), filename)
+        self.entries[key] = code
+        if len(self.entries) > self.size:
+            self.retire(self.entries.popitem(last=False)[1].co_filename)
+        return code
+
+    def retire(self, filename):
+        """Drop the source of the oldest evicted command from linecache,
+        once filename makes more than RETIRED_COMMANDS of them."""
+        self.retired.append(filename)
+        if len(self.retired) > RETIRED_COMMANDS:
+            linecache.cache.pop(self.retired.popleft(), None)
+
+
+def default_cache_dir():
+    """Return the directory holding the on-disk module cache."""
+    base = os.environ.get('XDG_CACHE_HOME') or \
+        os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'betterpythonconsole', 'bytecode')
+
+
+class ModuleCache:
+    """Compiled modules for Run Module, in memory and on disk.
+
+    An entry is reused without reading the file while its mtime and size
+    are unchanged. Otherwise the file is read and the entry is still
+    reused if the hash of its content matches, e.g. after a plain save.
+    On-disk entries are tied to the interpreter version, as marshal
+    data is not portable between versions."""
+
+    def __init__(self, directory=None):
+        self.directory = directory or default_cache_dir()
+        self.entries = {}
+
+    def entry_path(self, filename):
+        """Return the on-disk cache file for filename."""
+        key = '%s\0%s' % (sys.version, filename)
+        if not isinstance(key, bytes):
+            key = key.encode('utf-8')
+        name = hashlib.sha1(key).hexdigest()
+        return os.path.join(self.directory, name)
+
+    def load(self, filename):
+        """Return the on-disk entry for filename, or None."""
+        try:
+            f = open(self.entry_path(filename), 'rb')
+            try:
+                entry = marshal.load(f)
+            finally:
+                f.close()
+        except (IOError, OSError, EOFError, ValueError, TypeError):
+            return None
+        if not isinstance(entry, tuple) or len(entry) != 5 \
+                or entry[0] != sys.version:
+            return None
+        return entry[1:]
+
+    def store(self, filename, entry):
+        """Write the entry for filename to disk, ignoring failures."""
+        path = self.entry_path(filename)
+        tmp = '%s.%d' % (path, os.getpid())
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory, 0o700)
+            f = open(tmp, 'wb')
+            try:
+                marshal.dump((sys.version,) + entry, f)
+            finally:
+                f.close()
+            os.rename(tmp, path)
+        except (IOError, OSError, ValueError):
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+
+    def compile(self, filename):
+        """Return the code object of the module in filename.
+
+        Raises IOError if the file can not be read and SyntaxError if it
+        does not compile."""
+        filename = os.path.abspath(filename)
+        st = os.stat(filename)
+        entry = self.entries.get(filename)
+        if entry is not None and entry[:2] == (st.st_mtime, st.st_size):
+            return entry[3]
+
+        f = open(filename, 'rb')
+        try:
+            source = f.read()
+        finally:
+            f.close()
+        digest = hashlib.sha1(source).hexdigest()
+        if entry is None or entry[2] != digest:
+            entry = self.load(filename)
+        if entry is not None and entry[2] == digest:
+            code = entry[3]
+            entry = (st.st_mtime, st.st_size, digest, code)
+        else:
+            code = compile(source, filename, 'exec', 0, True)
+            entry = (st.st_mtime, st.st_size, digest, code)
+            self.store(filename, entry)
+        self.entries[filename] = entry
+        return code
+
+
+def split_cells(source):
+    """Split module source (bytes) at '# %%' markers.
+
+    Returns a list of (first line number, cell source) pairs, each marker
+    line starting a new cell. An empty cell before the first marker is
+    dropped."""
+    cells = []
+    first = 1
+    lines = []
+    for number, line in enumerate(source.splitlines(True)):
+        if CELL_RE.match(line) and (lines or cells):
+            if cells or b''.join(lines).strip():
+                cells.append((first, b''.join(lines)))
+            first = number + 1
+            lines = []
+        lines.append(line)
+    cells.append((first, b''.join(lines)))
+    return cells
+
+
+def compile_fragment(source, filename, first, flags=0):
+    """Compile source taken from line first of filename as interactive
+    input, so tracebacks point at the right lines of the file."""
+    return compile_interactive('\n' * (first - 1) + source, filename, flags)
+
+
+def compile_cell(source, filename, first):
+    """Compile a cell starting at line first of filename, so that
+    tracebacks point at the right lines of the file."""
+    return compile(b'\n' * (first - 1) + source, filename, 'exec', 0, True)
@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+
+#    This file is part of the Better Python Console Plugin for Gedit
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+"""Per command time and memory instrumentation.
+
+The console exposes a CommandStats object as __stats__. When enabled, it
+records the wall time, CPU time and peak RSS growth of every command or
+module run, plus the top allocations if tracemalloc is available and
+allocation tracing is on.
+"""
+
+import os
+import sys
+import time
+import fnmatch
+from collections import deque
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Standard modules the console itself allocates from while it runs a
+# command: output threads, result reprs, tracebacks and stream decoding
+CONSOLE_MODULES = ('threading', 'reprlib', 'repr', 'linecache', 'traceback',
+                   'codecs', 'weakref', '_weakrefset', 'tracemalloc')
+
+
+def console_filters():
+    """Return the tracemalloc filters hiding what the console allocates,
+    so only the allocations of the command are reported."""
+    filters = [tracemalloc.Filter(False, os.path.join(HERE, '*'))]
+    for name in CONSOLE_MODULES:
+        module = sys.modules.get(name)
+        filename = getattr(module, '__file__', None)
+        if filename:
+            filters.append(tracemalloc.Filter(False, filename))
+    # Filters match with fnmatch, compile the patterns now rather than
+    # while the allocations of the command are compared
+    for match in filters:
+        fnmatch.fnmatch('', match.filename_pattern)
+    return filters
+
+if hasattr(time, 'thread_time'):
+    cpu_time = time.thread_time
+else:
+    def cpu_time():
+        """CPU time of the process, when there is no per thread clock."""
+        if resource is None:
+            return time.clock()
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        return usage.ru_utime + usage.ru_stime
+
+
+def max_rss():
+    """Peak resident set size of the process, in kilobytes."""
+    if resource is None:
+        return 0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def format_size(size):
+    """Format a size in bytes."""
+    for unit in ('B', 'KB', 'MB'):
+        if abs(size) < 1024:
+            return '%.1f %s' % (size, unit)
+        size = size / 1024.0
+    return '%.1f GB' % size
+
+
+class CommandRecord:
+    """Measurements of one command."""
+
+    def __init__(self, label):
+        self.label = label
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.rss_growth = 0
+        self.allocations = []
+
+    def summary(self):
+        """Return the one line summary shown after the command output."""
+        parts = ['wall %.3f s' % self.wall, 'cpu %.3f s' % self.cpu,
+                 'peak rss +%s' % format_size(self.rss_growth)]
+        for where, size in self.allocations:
+            parts.append('%s %s' % (where, format_size(size)))
+        return '[%s]\n' % ' | '.join(parts)
+
+    def __repr__(self):
+        return '<%s %s>' % (self.label, self.summary().strip())
+
+
+class CommandStats:
+    """Instrumentation of the console commands, shown as __stats__.
+
+    Set enabled to record every command, and allocations to also trace
+    the top allocations (slower). The last limit records are kept."""
+
+    def __init__(self, enabled=False, allocations=False, limit=1000):
+        self.enabled = enabled
+        self.allocations = allocations and tracemalloc is not None
+        self.records = deque(maxlen=limit)
+        self.started_tracing = False
+
+    @property
+    def last(self):
+        """The record of the last command, or None."""
+        if self.records:
+            return self.records[-1]
+        return None
+
+    def begin(self, label):
+        """Start measuring a command, return the state given to end."""
+        snapshot = filters = None
+        if self.allocations and tracemalloc is not None:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self.started_tracing = True
+            # Made before the snapshot, so they do not show in the diff
+            filters = console_filters()
+            snapshot = tracemalloc.take_snapshot().filter_traces(filters)
+        return (CommandRecord(label), time.time(), cpu_time(), max_rss(),
+                snapshot, filters)
+
+    def end(self, state):
+        """Finish measuring a command and return its record."""
+        record, wall, cpu, rss, snapshot, filters = state
+        record.wall = time.time() - wall
+        record.cpu = cpu_time() - cpu
+        record.rss_growth = (max_rss() - rss) * 1024
+        if snapshot is not None:
+            stats = tracemalloc.take_snapshot().filter_traces(filters)
+            stats = stats.compare_to(snapshot, 'lineno')
+            for stat in stats[:3]:
+                if stat.size_diff > 0:
+                    frame = stat.traceback[0]
+                    record.allocations.append(
+                        ('%s:%d' % (os.path.basename(frame.filename),
+                                    frame.lineno), stat.size_diff))
+            if self.started_tracing:
+                tracemalloc.stop()
+                self.started_tracing = False
+        self.records.append(record)
+        return record
+
+    def clear(self):
+        """Forget the records."""
+        self.records.clear()
+
+    def __repr__(self):
+        lines = ['<CommandStats %s, %d records>' % (
+            self.enabled and 'enabled' or 'disabled', len(self.records))]
+        for record in list(self.records)[-10:]:
+            lines.append('  %s' % record)
+        return '\n'.join(lines)
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+
+#    This file is part of the Better Python Console Plugin for Gedit
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+"""Tab completion of names and attribute chains.
+
+Listing the attributes of a large module or class with dir() on every
+Tab press is slow, so the sorted listings are kept in an index. The
+listing of a module or a class is reused until its __dict__ changes
+size. The listing of an object with its own __dir__ can not be checked
+this way, so it is only reused until the next command runs. The index
+only holds weak references where it can, a listing goes with its object.
+
+Attribute chains are followed with getattr and nothing is called, so
+completing 'a.b.' runs no code except properties.
+"""
+
+import re
+import types
+import weakref
+import keyword
+from bisect import bisect_left
+
+# The chain of names before the cursor, e.g. 'os.path.' and 'jo'
+WORD_RE = re.compile(r'(?<![\w.\'")\]}])((?:[A-Za-z_]\w*\.)*)(\w*)$')
+
+# Listings kept in the index before it is emptied
+MAX_ENTRIES = 1000
+
+_object_dir = getattr(object, '__dir__', None)
+
+# Objects whose listing is checked through the size of their __dict__
+LISTED_TYPES = (types.ModuleType, type, getattr(types, 'ClassType', type))
+
+
+def columns(names, width=80, limit=500):
+    """Return names laid out in columns, at most limit of them."""
+    shown = names[:limit]
+    size = max([len(name) for name in shown]) + 2
+    per_line = max(width // size, 1)
+    lines = []
+    for i in range(0, len(shown), per_line):
+        lines.append(''.join([name.ljust(size)
+                              for name in shown[i:i + per_line]]).rstrip())
+    if len(names) > limit:
+        lines.append('... %d more' % (len(names) - limit))
+    return '\n'.join(lines) + '\n'
+
+
+def matching(names, prefix):
+    """Return the names of a sorted list which start with prefix."""
+    start = bisect_left(names, prefix)
+    end = start
+    while end < len(names) and names[end].startswith(prefix):
+        end = end + 1
+    return names[start:end]
+
+
+def reference(obj, table, key):
+    """Return a weak reference to obj removing its entry from table once
+    obj is gone, or a strong one if obj can not be weakly referenced (the
+    builtins dict, modules with Python 2)."""
+
+    def forget(ref):
+        entry = table.get(key)
+        if entry is not None and entry[0] is ref:
+            del table[key]
+
+    try:
+        return weakref.ref(obj, forget)
+    except TypeError:
+        return lambda: obj
+
+
+class CompletionIndex:
+    """Cache of the sorted attribute listings used for completion."""
+
+    def __init__(self):
+        self.entries = {}
+        # Listings which can not be checked, kept until the next command
+        self.recent = {}
+
+    def invalidate(self):
+        """Forget the listings which can not be checked, after a command
+        has run."""
+        self.recent.clear()
+
+    def listing(self, obj, stamp, make):
+        """Return the cached listing of obj while its stamp is unchanged,
+        or make a new one. A stamp of None keeps the listing until the
+        next command."""
+        table = self.recent if stamp is None else self.entries
+        key = id(obj)
+        entry = table.get(key)
+        if entry is not None and entry[0]() is obj and entry[1] == stamp:
+            return entry[2]
+        if len(table) >= MAX_ENTRIES:
+            table.clear()
+        names = sorted(set(make()))
+        table[key] = (reference(obj, table, key), stamp, names)
+        return names
+
+    def attributes(self, obj):
+        """Return the sorted attribute names of obj."""
+        if isinstance(obj, LISTED_TYPES):
+            return self.listing(obj, len(obj.__dict__), lambda: dir(obj))
+        kind = getattr(obj, '__class__', type(obj))
+        custom = getattr(kind, '__dir__', None)
+        if custom is not None and custom is not _object_dir:
+            return self.listing(obj, None, lambda: dir(obj))
+        names = self.attributes(kind)
+        own = getattr(obj, '__dict__', None)
+        if isinstance(own, dict) and own:
+            names = sorted(set(names).union(own))
+        return names
+
+    def builtin_names(self, namespace):
+        """Return the sorted names of the builtins and keywords."""
+        builtins = namespace.get('__builtins__', __builtins__)
+        if not isinstance(builtins, dict):
+            builtins = builtins.__dict__
+        return self.listing(builtins, len(builtins),
+                            lambda: list(builtins) + keyword.kwlist)
+
+    def complete(self, line, namespace):
+        """Return the word being typed at the end of line and the sorted
+        names completing it. Names starting with an underscore are only
+        offered when the word starts with one."""
+        match = WORD_RE.search(line)
+        if match is None:
+            return '', []
+        chain, word = match.groups()
+        try:
+            if chain:
+                names = chain[:-1].split('.')
+                if names[0] in namespace:
+                    obj = namespace[names[0]]
+                else:
+                    builtins = namespace.get('__builtins__', __builtins__)
+                    if isinstance(builtins, dict):
+                        obj = builtins[names[0]]
+                    else:
+                        obj = getattr(builtins, names[0])
+                for name in names[1:]:
+                    obj = getattr(obj, name)
+                found = matching(self.attributes(obj), word)
+            else:
+                found = set(matching(self.builtin_names(namespace), word))
+                found.update([name for name in list(namespace)
+                              if name.startswith(word)])
+                found = sorted(found)
+        except Exception:
+            return word, []
+        if not word.startswith('_'):
+            found = [name for name in found if not name.startswith('_')]
+        return word, found
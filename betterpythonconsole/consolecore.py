@@ -0,0 +1,1540 @@
+#!/usr/bin/env python
+
+#    This file is part of the Better Python Console Plugin for Gedit
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+#------------------------------------------------------------------------------
+#    The fake files, History and the command execution come from
+#    consoleinterface.py, based on pycons.py by Nicolas Rougier.
+#
+#    Original Copyright (c) 1998 James Henstridge, 2006 Nicolas Rougier
+#------------------------------------------------------------------------------
+
+
+""" Console engine, independent of any toolkit
+
+ConsoleCore holds everything a console does but drawing: the command
+history, statement completeness, output queueing, command execution on
+the main or a worker thread, Run Module, cell mode and profiling. A front
+end subclasses it and provides the few methods talking to its main loop
+and its display, see ConsoleCore.
+
+The GTK console window is one front end, HeadlessConsole is another one
+working on plain streams, used by the benchmarks and runnable on its own:
+
+    python consolecore.py [--threaded] [filename] < commands
+
+"""
+
+import os.path, sys, time, types, codecs, hashlib, traceback, threading
+import optparse, weakref
+from collections import deque
+
+import startuptrace
+import consolesettings
+import codecache
+import consolehistory
+import commandstats
+import resultrepr
+import completion
+import autoreload
+import runlimits
+from statementchecker import StatementChecker
+
+try:
+    import builtins
+except ImportError:
+    import __builtin__ as builtins
+
+startuptrace.mark ('core imports')
+
+if not hasattr(sys, 'ps1'):
+    sys.ps1 = '>>> '
+if not hasattr(sys, 'ps2'):
+    sys.ps2 = '... '
+
+# The module of the console script, kept alive while the modules of the
+# consoles replace it as sys.modules['__main__']
+script_module = sys.modules.get ('__main__')
+
+# The consoles of this process, told when it forks
+consoles = weakref.WeakSet()
+
+
+def any_running ():
+    """ Tell whether a console of this process is running something
+
+    The consoles of a process share the standard streams, and on the main
+    thread a run started from the trace function of another would nest
+    in it, so a console only starts a run when none is running.
+    """
+
+    for console in list (consoles):
+        if console.running:
+            return True
+    return False
+
+
+def after_fork ():
+    """ Tell the consoles they are in a forked child process """
+
+    for console in list (consoles):
+        console.after_fork()
+
+
+# Where os.register_at_fork is missing (Python 2), a console notices it is
+# in a forked child by its process id, see ConsoleCore.in_fork
+FORK_HOOK = hasattr (os, 'register_at_fork')
+
+if FORK_HOOK:
+    os.register_at_fork (after_in_child=after_fork)
+
+
+# =============================================================================
+class consoleoutfile:
+    """
+    A fake output file object.  It queues output on a console, and if
+    asked for a file number, returns one set on instance creation
+    """
+
+    def __init__(self, console, fn, font):
+        self.fn = fn
+        self.console = console
+        self.font = font
+    def close(self): pass
+    def flush(self):
+        if not (self.console.forked or
+                (not FORK_HOOK and self.console.in_fork())):
+            self.console.call_main (self.console.flush_output)
+    def fileno(self):    return self.fn
+    def isatty(self):    return False
+    def read(self, a):   return ''
+    def readline(self):  return ''
+    def readlines(self): return []
+    def write(self, s):
+        if self.console.forked or (not FORK_HOOK and self.console.in_fork()):
+            # In a worker process forked by a command, whose descriptor is
+            # routed back to the console by an OutputRedirect
+            if not isinstance (s, bytes):
+                s = s.encode ('utf-8', 'replace')
+            os.write (self.fn, s)
+            return
+        self.console.queue_write (s, self.font)
+    def writelines(self, l):
+        for s in l:
+            self.write (s)
+    def seek(self, a):   raise IOError(29, 'Illegal seek')
+    def tell(self):      raise IOError(29, 'Illegal seek')
+    truncate = tell
+
+
+# =============================================================================
+class OutputRedirect:
+    """ Redirection of a file descriptor into a console while it runs code
+
+    What is written straight to the descriptor, by C code, subprocesses or
+    the worker processes started by a command, is read by a thread and
+    queued on the console with the given style. Processes started during
+    a run keep the redirected descriptor, and their output keeps showing
+    in the console after the run.
+
+    The destination of the descriptor is saved again on every start, as it
+    may be the redirection of another console running at the same time.
+    """
+
+    def __init__ (self, console, fd, style, stream):
+        self.console = console
+        self.fd = fd
+        self.style = style
+        self.stream = stream
+        self.saved = None
+        self.pipe = None
+
+    def start (self):
+        """ Redirect the descriptor to the console """
+
+        if self.pipe is None:
+            try:
+                read, self.pipe = os.pipe()
+            except OSError:
+                self.pipe = None
+                return
+            reader = threading.Thread (target=self.read, args=(read,))
+            reader.daemon = True
+            reader.start()
+        try:
+            self.saved = os.dup (self.fd)
+        except OSError:
+            self.saved = None
+            return
+        self.flush_stream()
+        os.dup2 (self.pipe, self.fd)
+
+    def stop (self):
+        """ Give the descriptor back its original destination """
+
+        if self.saved is not None:
+            self.flush_stream()
+            os.dup2 (self.saved, self.fd)
+            os.close (self.saved)
+            self.saved = None
+
+    def flush_stream (self):
+        """ Flush what the real stream holds, before a redirection """
+
+        try:
+            self.stream.flush()
+        except (IOError, OSError, ValueError):
+            pass
+
+    def read (self, fd):
+        """ Body of the thread moving the output to the console
+
+        A character split between two reads is held back by the decoder
+        until it is complete. With Python 2 the text is encoded back to
+        UTF-8, like the rest of the output of the console.
+        """
+
+        decoder = codecs.getincrementaldecoder ('utf-8') ('replace')
+        while True:
+            try:
+                data = os.read (fd, 65536)
+            except OSError:
+                data = None
+            text = decoder.decode (data or b'', not data)
+            if not isinstance (text, str):
+                text = text.encode ('utf-8')
+            if text:
+                self.console.queue_write (text, self.style)
+            if not data:
+                break
+
+
+
+# =============================================================================
+class consoleinfile:
+    """
+    A fake input file object.  It reads lines typed in a console, and if
+    asked for a file number, returns one set on instance creation
+    """
+
+    def __init__(self, console, fn):
+        self.fn = fn
+        self.console = console
+    def close(self): pass
+    flush = close
+    def fileno(self):    return self.fn
+    def isatty(self):    return False
+    def read(self, a):   return self.readline()
+    def readline(self):
+        if self.console.closed:
+            return ''
+        if self.console.on_main_thread():
+            # Let the front end wait for the line, without the trace
+            # function running on every line of its main loop
+            self.console.flush_output()
+            self.console.input_mode = True
+            trace = sys.gettrace()
+            sys.settrace (None)
+            try:
+                self.console.wait_input()
+            finally:
+                sys.settrace (trace)
+            self.console.check_stop()
+        else:
+            # Running on the worker thread, wait for the line to be sent
+            event = threading.Event()
+            self.console.call_main (self.console.request_input, event)
+            event.wait()
+        if self.console.closed:
+            return ''
+        s = self.console.input
+        self.console.input = ''
+        return s+'\n'
+    def readlines(self): return []
+    def write(self, s):  return None
+    def writelines(self, l): return None
+    def seek(self, a):   raise IOError(29, 'Illegal seek')
+    def tell(self):      raise IOError(29, 'Illegal seek')
+    truncate = tell
+
+
+def print_stopped (exc_type, value, tb):
+    """ Print the traceback of a stopped command, without the frames of
+    the trace function or the signal handler which raised the exception """
+
+    ours = [os.path.splitext (os.path.abspath (filename))[0]
+            for filename in (__file__, runlimits.__file__)]
+    entries = [entry for entry in traceback.extract_tb (tb)
+               if os.path.splitext (os.path.abspath (entry[0]))[0] not in ours]
+    sys.stderr.write ('Traceback (most recent call last):\n' +
+                      ''.join (traceback.format_list (entries)) +
+                      ''.join (traceback.format_exception_only (exc_type,
+                                                                value)))
+
+
+
+# =============================================================================
+class History:
+    """ Command history class
+
+    Entries live in a HistoryStore shared with the other consoles. Up and
+    Down only go through the entries starting with what was typed before
+    the first Up, and search does the Ctrl-R reverse search. The positions
+    in the store follow it as it picks up entries and trims old ones.
+    """
+
+    def __init__ (self, store=None):
+        """ Initializes history """
+
+        if store is None:
+            store = consolehistory.HistoryStore()
+        self.store = store
+        self.position = len (self.store)
+        self.prefix = ''
+        self.edited = ''
+        self.search_position = None
+        self.dropped = store.dropped
+        self.reloads = store.reloads
+
+    def sync (self):
+        """ Pick up the entries added by the other consoles, and shift the
+        positions past the entries trimmed since the last move """
+
+        at_end = self.position >= len (self.store)
+        self.store.refresh()
+        if self.store.reloads != self.reloads:
+            # The file was compacted, start again from the newest entry
+            self.reloads = self.store.reloads
+            self.dropped = self.store.dropped
+            self.position = len (self.store)
+            self.search_position = None
+            return
+        shift = self.store.dropped - self.dropped
+        self.dropped = self.store.dropped
+        if at_end:
+            self.position = len (self.store)
+        else:
+            self.position = max (self.position - shift, 0)
+        if self.search_position is not None:
+            self.search_position = max (self.search_position - shift, 0)
+
+    def prev (self, current):
+        """ Get previous command in history """
+
+        self.sync()
+        l = current
+        if len(l) > 0 and l[0] == '\n': l = l[1:]
+        if len(l) > 0 and l[-1] == '\n': l = l[:-1]
+        if self.position >= len (self.store):
+            self.position = len (self.store)
+            self.edited = l
+            self.prefix = l
+        index = self.position
+        while True:
+            index = self.store.search_prefix (self.prefix, index)
+            if index is None:
+                return current
+            if self.store[index] != l:
+                break
+        self.position = index
+        return self.store[index]
+
+    def next (self, current):
+        """ Get next command in history """
+
+        self.sync()
+        if self.position >= len (self.store):
+            return current
+        index = self.position
+        while True:
+            index = self.store.search_prefix_forward (self.prefix, index)
+            if index is None:
+                self.position = len (self.store)
+                return self.edited
+            if self.store[index] != current:
+                break
+        self.position = index
+        return self.store[index]
+
+    def append (self, line):
+        """ Append a new command to history """
+
+        self.extend ([line])
+
+    def extend (self, lines):
+        """ Append new commands to history, the lines of a paste are
+        written to the history file at once """
+
+        batch = []
+        last = self.store[-1] if len (self.store) else None
+        for l in lines:
+            if len(l) and l != last:
+                batch.append (l)
+                last = l
+        if batch:
+            self.store.extend (batch)
+        self.sync()
+        self.position = len (self.store)
+
+    def search (self, query):
+        """ Get the next older command containing query, or None """
+
+        self.sync()
+        if self.search_position is None:
+            self.search_position = len (self.store)
+        index = self.search_position
+        shown = None
+        if index < len (self.store):
+            shown = self.store[index]
+        while True:
+            index = self.store.search (query, index)
+            if index is None:
+                return None
+            if self.store[index] != shown:
+                break
+        self.search_position = index
+        return self.store[index]
+
+    def reset_search (self):
+        """ Start the next reverse search from the newest command """
+
+        self.search_position = None
+
+    def open (self, filename):
+        """ Open an history file """
+
+        self.store = consolehistory.HistoryStore (filename, self.store.size)
+        self.position = len (self.store)
+        self.search_position = None
+        self.dropped = self.store.dropped
+        self.reloads = self.store.reloads
+
+    def save (self, filename):
+        """ Save history to a file """
+
+        file = consolehistory.open_text (filename, 'w')
+        for l in self.store.entries:
+            if len(l) > 0:
+                file.write(consolehistory.encode (l))
+        file.close()
+
+    def __repr__(self):
+        """ History representation """
+
+        return '<History of %d commands, stored in %s>' % (
+            len (self.store), self.store.path)
+
+
+
+# =============================================================================
+class ConsoleCore (object):
+    """ Console engine shared by the front ends
+
+    A front end provides the methods below which raise
+    NotImplementedError, they are the only ones touching its display or
+    its main loop: write, write_runs, process_events, post, call_later,
+    schedule_flush, cancel_flush, wait_input and quit.
+
+    Code runs in a real module, installed as sys.modules['__main__'], so
+    that what it defines can be pickled, e.g. by multiprocessing. When
+    route_output is True, what is written to the standard output and
+    error descriptors during a run shows in the console as well.
+
+    Once a command has imported asyncio, a persistent event loop is run
+    in steps from the main loop of the front end, so tasks go on between
+    commands. A command using top level await runs as a task on it.
+    """
+
+    route_output = False
+
+    def __init__ (self, namespace, quit_handler = None, threaded = False):
+        """ Initialize the console engine
+
+        If threaded is True, commands run on a worker thread and talk to
+        the main loop through post, otherwise they run on the main thread
+        with a trace function calling process_events.
+        """
+
+        self.cmd = ''
+        self.prompt = sys.ps1
+        self.checker = StatementChecker()
+        self.code_cache = codecache.CommandCache()
+        self.module_cache = codecache.ModuleCache()
+        self.cell_runs = {}
+        self.last_error = False
+        self.last_duration = 0.0
+        self.profiler = None
+        self.input = ''
+        self.input_mode = False
+        self.input_event = None
+        self.input_loop = None
+        self.closed = False
+        self.forked = False
+        self.pid = os.getpid()
+        self.threaded = threaded
+        self.running = False
+        self.main_thread = threading.current_thread()
+        self.worker = None
+        self.stop_request = None
+        # Reentrant, the signal handlers of the run limits call stop on
+        # the main thread, which may be holding it
+        self.stop_lock = threading.RLock()
+        self.ready_handler = None
+        self.quit_handler = quit_handler or self.quit
+
+        # Output queued by the fake files, as [style, [chunks]] runs
+        self.pending = []
+        self.pending_lock = threading.Lock()
+        self.flush_source = None
+
+        # Setup hooks for standard output.
+        self.stdout = consoleoutfile (self, sys.stdout.fileno(), 'normal')
+        self.stderr = consoleoutfile (self, sys.stderr.fileno(), 'error')
+        self.stdin  = consoleinfile (self, sys.stdin.fileno())
+
+        # Setup command history
+        size = consolesettings.get('history_size')
+        path = None
+        if size:
+            path = (consolesettings.get('history_file') or
+                    consolehistory.default_history_file())
+        self.history = History (consolehistory.HistoryStore (path, size or
+                                                             100000))
+
+        # Setup instrumentation
+        self.stats = commandstats.CommandStats (
+            consolesettings.get('instrument'),
+            consolesettings.get('trace_allocations'))
+
+        # Setup the display of expression results
+        self.results = resultrepr.ResultFormatter (
+            consolesettings.get('result_items'),
+            consolesettings.get('result_chars'))
+        self.saved_displayhook = None
+        self.completer = completion.CompletionIndex()
+
+        # Setup the limits of each run
+        self.limits = runlimits.RunLimits (
+            consolesettings.get('limit_wall_seconds'),
+            consolesettings.get('limit_cpu_seconds'),
+            consolesettings.get('limit_memory_mb'))
+
+        # Setup the reload of edited user modules
+        self.reloader = None
+        if consolesettings.get('autoreload'):
+            self.reloader = autoreload.ModuleReloader()
+
+        # Setup the asyncio loop, started once a command uses asyncio
+        self.use_asyncio = (consolesettings.get('asyncio')
+                            and sys.version_info[0] >= 3)
+        self.compile_flags = 0
+        if self.use_asyncio:
+            self.compile_flags = codecache.TOP_LEVEL_AWAIT
+        self.loop_driver = None
+        self.awaiting = None
+        self.awaited_task = None
+
+        # Setup the routing of the output written to the descriptors
+        self.redirects = []
+        if self.route_output:
+            self.redirects = [
+                OutputRedirect (self, self.stdout.fn, 'normal', sys.__stdout__),
+                OutputRedirect (self, self.stderr.fn, 'error', sys.__stderr__)]
+
+        self.set_namespace (namespace)
+        consoles.add (self)
+
+
+    # Front end interface ----------------------------------------------------
+
+    def write (self, line, style=None):
+        """ Write a line using given style (if any), after the queued
+        output """
+
+        raise NotImplementedError
+
+
+    def write_runs (self, runs):
+        """ Write queued output, a list of [style, [chunks]] runs
+
+        The style of a run is a style name, None or the Expansion of a
+        result which is not fully shown, its text being the label of the
+        expansion.
+        """
+
+        raise NotImplementedError
+
+
+    def process_events (self):
+        """ Handle the pending main loop events, called on every line of
+        a command running on the main thread """
+
+        raise NotImplementedError
+
+
+    def post (self, func, *args):
+        """ Call func (*args) from the main loop, may be called from any
+        thread """
+
+        raise NotImplementedError
+
+
+    def call_later (self, delay, func):
+        """ Call func () from the main loop after delay seconds, called
+        on the main thread """
+
+        raise NotImplementedError
+
+
+    def schedule_flush (self):
+        """ Arrange for on_flush_timeout to be called from the main loop,
+        again while it returns True, and return a handle for cancel_flush,
+        pending_lock is held """
+
+        raise NotImplementedError
+
+
+    def cancel_flush (self, source):
+        """ Cancel a flush returned by schedule_flush """
+
+        raise NotImplementedError
+
+
+    def wait_input (self):
+        """ Wait on the main thread until end_input is called or the
+        console is closed """
+
+        raise NotImplementedError
+
+
+    def quit (self, *args):
+        """ Default handler on quit """
+
+        raise NotImplementedError
+
+
+    def report_missing (self, filename):
+        """ Tell that a module to run does not exist """
+
+        self.write ("Unable to open '%s', the file does not exist.\n"
+                    % filename, 'error')
+
+
+    # Prompts and output -----------------------------------------------------
+
+    def prompt1 (self):
+        """ Display normal prompt """
+
+        self.prompt = sys.ps1
+        self.write (self.prompt, 'prompt')
+        if self.ready_handler:
+            self.ready_handler()
+
+
+    def prompt2 (self):
+        """ Display continuation prompt """
+
+        self.prompt = sys.ps2
+        self.write (self.prompt, 'prompt')
+
+
+    def queue_write (self, line, style=None):
+        """ Queue a line for the next flush, may be called from any thread
+
+        Consecutive writes with the same style are merged into one run, so a
+        flush costs one insert per run rather than one per write.
+        """
+
+        with self.pending_lock:
+            if self.pending and self.pending[-1][0] == style:
+                self.pending[-1][1].append (line)
+            else:
+                self.pending.append ([style, [line]])
+            if self.flush_source is None:
+                self.flush_source = self.schedule_flush()
+
+
+    def on_flush_timeout (self):
+        """ Main loop callback flushing the queued output
+
+        The lock is never waited for here: the callback may run from the
+        trace function in the middle of a queue_write on the same thread,
+        which holds it. The flush is then left scheduled and retried by the
+        timer of the front end, or done by the next write.
+        """
+
+        if not self.pending_lock.acquire (False):
+            return True
+        try:
+            self.flush_source = None
+        finally:
+            self.pending_lock.release()
+        self.flush_output()
+        return False
+
+
+    def flush_output (self):
+        """ Write all queued output at once """
+
+        with self.pending_lock:
+            pending, self.pending = self.pending, []
+            if self.flush_source is not None:
+                self.cancel_flush (self.flush_source)
+                self.flush_source = None
+        if pending:
+            self.write_runs (pending)
+
+
+    def displayhook (self, value):
+        """ Show the value of an expression statement
+
+        Unlike sys.displayhook, the size of what is shown is bounded. The
+        rest of a large value is queued as an Expansion, which the front
+        end can render page by page.
+        """
+
+        if value is None:
+            return
+        builtins._ = None
+        head, rest, tail = self.results.format (value)
+        self.queue_write (head, 'normal')
+        if rest is not None:
+            self.queue_write (rest.label(), rest)
+        self.queue_write (tail + '\n', 'normal')
+        builtins._ = value
+
+
+    # Input ------------------------------------------------------------------
+
+    def is_balanced (self, line):
+        """ Checks line balance for brace, bracket, parenthese and string quote
+
+        This helper function checks for the balance of brace, bracket,
+        parenthese and string quote. Any unbalanced line means to wait until
+        some other lines are fed to the console.
+        """
+
+        checker = StatementChecker()
+        for l in line.split ('\n'):
+            checker.feed (l)
+        return not checker.is_open()
+
+
+    def completions (self, line):
+        """ Return the word at the end of line and its completions """
+
+        return self.completer.complete (line, self.namespace)
+
+
+    def push (self, lines):
+        """ Add lines of input to the current command
+
+        Every line is fed to the statement checker, only the last one
+        decides whether the statement is complete. A complete statement is
+        executed, otherwise the continuation prompt is shown and True is
+        returned.
+        """
+
+        more = False
+        self.history.extend (lines)
+        for l in lines:
+            self.cmd = self.cmd + l + '\n'
+            more = self.checker.push (l)
+        if more:
+            self.prompt2()
+            return True
+
+        cmd = self.cmd
+        self.cmd = ''
+        self.checker.reset()
+        self.reload_modules()
+        self.execute (cmd, self.prompt1)
+        return False
+
+
+    def busy (self):
+        """ Tell whether the console is running something or waiting for
+        the rest of a statement """
+
+        return self.running or self.input_mode or bool (self.cmd)
+
+
+    def run_source (self, source, filename='<editor>', first=1, done=None):
+        """ Run source sent from the editor in the console namespace
+
+        The source is shown after the prompt and runs as if it was typed,
+        with tracebacks pointing at its lines in filename, from line
+        first. done (if any) is called after the next prompt is shown.
+        Returns False, without running anything, when the console is busy.
+        """
+
+        if self.busy():
+            return False
+        self.write (source.rstrip() + '\n', 'script')
+
+        def finished ():
+            self.prompt1()
+            if done:
+                done()
+
+        try:
+            code = codecache.compile_fragment (source, filename, first,
+                                               self.compile_flags)
+        except (SyntaxError, ValueError, TypeError):
+            info = sys.exc_info()
+            self.write (''.join (
+                traceback.format_exception_only (info[0], info[1])), 'error')
+            finished()
+            return True
+        self.reload_modules()
+        self.execute (code, finished)
+        return True
+
+
+    def request_input (self, event):
+        """ Wait for a line of input on behalf of the worker thread """
+
+        self.flush_output()
+        self.input_mode = True
+        self.input_event = event
+
+
+    def end_input (self):
+        """ Wake up whoever is waiting for a line of input """
+
+        if self.input_loop is not None:
+            self.input_loop.quit()
+        if self.input_event is not None:
+            self.input_event.set()
+            self.input_event = None
+
+
+    def close_input (self):
+        """ Mark the console closed, pending and further reads get EOF """
+
+        self.closed = True
+        self.input_mode = False
+        self.end_input()
+
+
+    # Execution --------------------------------------------------------------
+
+    def idle (self, frame, event, arg):
+        """ Idle function to be used when running a command.
+
+        This idle function is set as a trace function when executing some
+        commands, it allows to process events even when executing code.
+        Nothing is processed while the output is being queued, a flush
+        would wait for the lock held by the interrupted queue_write.
+        """
+
+        if self.forked or (not FORK_HOOK and self.in_fork()):
+            return None
+        if not self.pending_lock.locked():
+            self.process_events()
+        if self.stop_request is not None:
+            self.check_stop()
+        return self.idle
+
+
+    def interrupt (self):
+        """ Interrupt the running command with a KeyboardInterrupt """
+
+        self.stop (KeyboardInterrupt)
+
+
+    def stop (self, exc):
+        """ Stop the running command by raising the exception class exc in
+        it, can be called from any thread
+
+        A command running on the main thread raises it from the idle trace
+        function, a worker thread gets it as an asynchronous exception.
+        """
+
+        self.stop_lock.acquire()
+        try:
+            if not self.running:
+                return
+            if self.awaited_task is not None:
+                self.call_main (self.cancel_awaited)
+            elif self.worker is not None:
+                runlimits.async_raise (self.worker.ident, exc)
+            else:
+                self.stop_request = exc
+        finally:
+            self.stop_lock.release()
+        if self.input_mode:
+            self.call_main (self.cancel_input)
+
+
+    def check_stop (self):
+        """ Raise the exception requested by stop, on the main thread """
+
+        exc, self.stop_request = self.stop_request, None
+        if exc is not None:
+            raise exc
+
+
+    def cancel_input (self):
+        """ Give up waiting for a line of input, as the command stops """
+
+        if self.input_mode:
+            self.input_mode = False
+            self.input = ''
+            self.write ('\n')
+            self.end_input()
+
+
+    def on_main_thread (self):
+        """ Tell whether we are running on the main loop thread """
+
+        return threading.current_thread() is self.main_thread
+
+
+    def call_main (self, func, *args):
+        """ Call func on the main loop thread
+
+        On the main thread func is called right away, from any other thread
+        the call is marshalled to the main loop with post.
+        """
+
+        if self.on_main_thread():
+            return func (*args)
+        self.post (func, *args)
+
+
+    def execute (self, cmd, done=None, threaded=None):
+        """ Execute a given command
+
+        In threaded mode the command runs on a worker thread and this method
+        returns immediately, in both modes done (if any) is called on the
+        main thread once the command has finished. threaded overrides the
+        mode of the console for this command.
+        """
+
+        self.swap_io()
+        sys.modules['__main__'] = self.main_module
+        for redirect in self.redirects:
+            redirect.start()
+        if threaded is None:
+            threaded = self.threaded
+        self.stop_request = None
+        self.running = True
+        self.limits.start (self.stop, not threaded)
+
+        if threaded:
+            self.worker = threading.Thread (target=self.execute_worker,
+                                            args=(cmd, done))
+            self.worker.daemon = True
+            self.worker.start()
+            return
+
+        sys.settrace (self.idle)
+        self.run (cmd)
+        sys.settrace (None)
+        self.execute_done (done)
+
+
+    def in_fork (self):
+        """ Tell whether this is a child process forked while running a
+        command, noticed by its process id where no fork hook runs """
+
+        if not self.forked and os.getpid() != self.pid:
+            self.after_fork()
+        return self.forked
+
+
+    def after_fork (self):
+        """ Called in a child process forked while running a command, e.g.
+        a process pool worker, which must not touch the front end """
+
+        self.forked = True
+        sys.settrace (None)
+
+
+    def execute_worker (self, cmd, done):
+        """ Body of the worker thread used in threaded mode """
+
+        if self.loop_driver is not None:
+            self.loop_driver.make_current()
+        try:
+            try:
+                self.run (cmd)
+            finally:
+                # Cancel a stop arriving as the command ends
+                self.stop_lock.acquire()
+                self.worker = None
+                runlimits.async_raise (threading.current_thread().ident,
+                                       None)
+                self.stop_lock.release()
+        except KeyboardInterrupt:
+            self.worker = None
+        self.post (self.execute_done, done)
+
+
+    def execute_done (self, done):
+        """ Restore the standard streams once a command has finished """
+
+        self.stop_lock.acquire()
+        self.running = False
+        self.stop_request = None
+        self.stop_lock.release()
+        self.limits.finish()
+        for redirect in self.redirects:
+            redirect.stop()
+        self.swap_io()
+        self.completer.invalidate()
+        if self.reloader:
+            self.reloader.update_index()
+        if self.awaiting is not None:
+            coro, self.awaiting = self.awaiting, None
+            self.await_coroutine (coro, done)
+            return False
+        self.drive_async()
+        if done:
+            done()
+        return False
+
+
+    def swap_io (self):
+        """ Swap the standard streams and displayhook with those of the
+        console, on entering a run and again on leaving it """
+
+        sys.stdout, self.stdout = self.stdout, sys.stdout
+        sys.stderr, self.stderr = self.stderr, sys.stderr
+        sys.stdin,  self.stdin  = self.stdin,  sys.stdin
+        if self.saved_displayhook is None:
+            self.saved_displayhook = sys.displayhook
+            sys.displayhook = self.displayhook
+        else:
+            sys.displayhook = self.saved_displayhook
+            self.saved_displayhook = None
+
+
+    # Asyncio ----------------------------------------------------------------
+
+    def drive_async (self, start=False):
+        """ Step the asyncio loop from the main loop, once asyncio has
+        been imported or when start is True """
+
+        if self.loop_driver is not None:
+            self.loop_driver.attach()
+        elif self.use_asyncio and (start or 'asyncio' in sys.modules):
+            import asyncloop
+            self.loop_driver = asyncloop.LoopDriver (self)
+
+
+    def can_step (self):
+        """ Tell whether the asyncio loop may run, that is between
+        commands or while a command awaits """
+
+        return not self.running or self.awaited_task is not None
+
+
+    def await_coroutine (self, coro, done):
+        """ Run the coroutine of a command using top level await as a
+        task, the command is over once the task is done """
+
+        self.drive_async (True)
+        self.running = True
+        self.awaited_task = self.loop_driver.run_task (
+            coro, lambda task: self.await_done (task, coro.cr_code, done))
+
+
+    def await_done (self, task, code, done):
+        """ Report the outcome of an awaited command, called from a step
+        of the loop with the console streams in place """
+
+        self.stop_lock.acquire()
+        self.awaited_task = None
+        self.running = False
+        self.stop_lock.release()
+        self.last_error = True
+        if task.cancelled():
+            sys.stderr.write ('KeyboardInterrupt\n')
+        elif task.exception() is None:
+            self.last_error = False
+        else:
+            exc = task.exception()
+            tb = exc.__traceback__
+            # Skip the frames of asyncio, down to the command
+            while tb is not None and tb.tb_frame.f_code is not code:
+                tb = tb.tb_next
+            traceback.print_exception (type (exc), exc,
+                                       tb or exc.__traceback__)
+            if isinstance (exc, SystemExit):
+                self.quit_handler()
+        self.completer.invalidate()
+        if done:
+            done()
+
+
+    def cancel_awaited (self):
+        """ Cancel the task of the command awaiting, on Ctrl-C """
+
+        if self.awaited_task is not None:
+            self.awaited_task.cancel()
+            self.loop_driver.schedule()
+
+
+    def reload_modules (self):
+        """ Reload the user modules changed since they were loaded, when
+        autoreload is on """
+
+        if not self.reloader:
+            return
+        changed = self.reloader.changed()
+        if not changed:
+            return
+        self.write ('Reloading %s\n' % ', '.join (changed), 'extern')
+        sys.stdout, self.stdout = self.stdout, sys.stdout
+        sys.stderr, self.stderr = self.stderr, sys.stderr
+        try:
+            for name in changed:
+                try:
+                    self.reloader.reload (name)
+                except Exception:
+                    info = sys.exc_info()
+                    self.write (''.join (traceback.format_exception (
+                        info[0], info[1],
+                        autoreload.reload_traceback (info[2].tb_next))),
+                        'error')
+        finally:
+            sys.stdout, self.stdout = self.stdout, sys.stdout
+            sys.stderr, self.stderr = self.stderr, sys.stderr
+        self.completer.invalidate()
+
+
+    def run (self, cmd):
+        """ Run a command in the console namespace and report errors
+
+        cmd is either source text or an already compiled code object.
+        The outcome is left in last_error and last_duration.
+        """
+
+        self.last_error = True
+        start = time.time()
+        measure = None
+        try:
+            try:
+                code = cmd
+                if not isinstance (code, types.CodeType):
+                    code = self.code_cache.compile (cmd, self.compile_flags)
+            except SyntaxError:
+                info = sys.exc_info()
+                traceback.print_exception (info[0], info[1], None)
+                return
+            if self.stats.enabled:
+                measure = self.stats.begin (code.co_filename)
+            if self.profiler is not None:
+                self.profiler.start()
+            if code.co_flags & codecache.CO_COROUTINE:
+                # Top level await, execute_done runs it on the loop
+                self.awaiting = eval (code, self.namespace)
+            else:
+                try:
+                    exec (code, self.namespace)
+                finally:
+                    self.limits.stop_timers()
+            self.last_error = False
+        except:
+            if hasattr (sys, 'last_type') and sys.last_type == SystemExit:
+                self.call_main (self.quit_handler)
+            else:
+                try:
+                    info = sys.exc_info()
+                    tb = info[2]
+                    if tb:
+                        tb = tb.tb_next
+                    if issubclass (info[0], KeyboardInterrupt):
+                        print_stopped (info[0], info[1], tb)
+                    else:
+                        traceback.print_exception (info[0], info[1], tb)
+                    stopped = self.limits.describe (info[0])
+                    if stopped:
+                        sys.stderr.write ('Stopped: %s\n' % stopped)
+                except:
+                    sys.stderr, self.stderr = self.stderr, sys.stderr
+                    traceback.print_exc()
+        if self.profiler is not None:
+            self.profiler.stop()
+        if measure is not None:
+            self.queue_write (self.stats.end (measure).summary(), 'stats')
+        self.last_duration = time.time() - start
+
+
+    def open (self, filename, profile=False):
+        """ Open and execute a given filename, under the sampling profiler
+        if profile is True """
+
+        if not filename:
+            return
+        if not os.path.exists (filename):
+            self.report_missing (filename)
+            return
+
+        # Run as a script run from the command line would, so that
+        # multiprocessing can start processes running it
+        self.namespace['__file__'] = os.path.abspath (filename)
+        sys.argv = [filename]
+
+        # By here we need to have the Path sorted out
+        # or we will be north of the river.
+        # Does not matter if it has been called without a file.
+        # Only added once, so lookups do not slow down as runs go by.
+        directory = os.path.dirname(filename)
+        if directory not in sys.path:
+            sys.path.append(directory)
+        autoreload.dedupe_path(sys.path)
+
+        self.write ("Executing '%s'\n\n" % filename, 'extern')
+        self.write ('\n')
+        self.reload_modules()
+        if consolesettings.get('cell_mode') and not profile:
+            try:
+                f = open (filename, 'rb')
+                try:
+                    cells = codecache.split_cells (f.read())
+                finally:
+                    f.close()
+            except (IOError, OSError):
+                cells = []
+            if len (cells) > 1:
+                self.run_cells (os.path.abspath (filename), cells)
+                return
+
+        # The module is compiled (or loaded from the cache) on a helper
+        # thread, so the front end keeps drawing, e.g. maps its window
+        self.running = True
+        compiler = threading.Thread (target=self.compile_module,
+                                     args=(filename, profile))
+        compiler.daemon = True
+        compiler.start()
+
+
+    def compile_module (self, filename, profile):
+        """ Body of the thread compiling a module for open """
+
+        try:
+            code = self.module_cache.compile (filename)
+        except (SyntaxError, IOError, OSError):
+            self.post (self.module_failed, sys.exc_info()[1])
+            return
+        startuptrace.mark ('module compiled')
+        self.post (self.run_module, filename, code, profile)
+
+
+    def module_failed (self, error):
+        """ Report a module which could not be compiled """
+
+        self.running = False
+        self.write (''.join (
+            traceback.format_exception_only (type (error), error)), 'error')
+        self.prompt1()
+
+
+    def run_module (self, filename, code, profile):
+        """ Run the compiled code of a module, under the sampling profiler
+        if profile is True
+
+        A profiled module always runs on a worker thread: on the main
+        thread, the trace function pumping the events would slow it down
+        many times over and skew the profile.
+        """
+
+        self.running = False
+        if profile:
+            import sampleprofiler
+            self.profiler = sampleprofiler.SamplingProfiler (
+                consolesettings.get('profile_interval_ms') / 1000.0,
+                stop_codes=[self.run.__func__.__code__],
+                skip_codes=[self.idle.__func__.__code__])
+            self.execute (code, lambda: self.profile_done (filename),
+                          threaded=True)
+        else:
+            self.execute (code, self.prompt1)
+
+
+    def profile_done (self, filename):
+        """ Report the profile of a module and save its samples """
+
+        import sampleprofiler
+        profiler, self.profiler = self.profiler, None
+        directory = (consolesettings.get('profile_dir') or
+                     sampleprofiler.default_profile_dir())
+        name = '%s-%s.collapsed' % (os.path.basename (filename),
+                                    time.strftime ('%Y%m%d-%H%M%S'))
+        path = os.path.join (directory, name)
+        self.write ('\nProfile of %s\n' % filename, 'extern')
+        self.write (profiler.report(), 'extern')
+        try:
+            profiler.save (path)
+            self.write ('Collapsed stacks saved to %s\n' % path, 'extern')
+        except (IOError, OSError):
+            info = sys.exc_info()
+            self.write ('Unable to save the collapsed stacks: %s\n'
+                        % info[1], 'error')
+        self.prompt1()
+
+    def run_cells (self, filename, cells):
+        """ Run the cells of a module, skipping the unchanged leading ones
+
+        The digest and duration of each cell which ran fine are kept in
+        cell_runs. Cells before the first one whose source changed since
+        then are skipped and the live namespace is reused for them; when
+        nothing changed, the last cell runs again.
+        """
+
+        digests = [hashlib.sha1 (text).hexdigest() for first, text in cells]
+        previous = self.cell_runs.get (filename, [])
+        start = 0
+        while (start < len (previous) and start < len (cells) - 1
+               and previous[start][0] == digests[start]):
+            start = start + 1
+        if start:
+            saved = sum ([duration for digest, duration in previous[:start]])
+            self.write ("Skipped unchanged cells 1-%d of %d, saving %.2f s\n\n"
+                        % (start, len (cells), saved), 'extern')
+        self.cell_runs[filename] = previous[:start]
+        self.run_cell (filename, cells, digests, start)
+
+
+    def run_cell (self, filename, cells, digests, index):
+        """ Run cell index of a module, then the following ones """
+
+        if index >= len (cells):
+            self.prompt1()
+            return
+        first, text = cells[index]
+        try:
+            code = codecache.compile_cell (text, filename, first)
+        except SyntaxError:
+            info = sys.exc_info()
+            self.write (''.join (
+                traceback.format_exception_only (info[0], info[1])), 'error')
+            self.prompt1()
+            return
+
+        def done ():
+            if self.last_error:
+                self.prompt1()
+                return
+            self.cell_runs[filename].append (
+                (digests[index], self.last_duration))
+            self.run_cell (filename, cells, digests, index + 1)
+        self.execute (code, done)
+
+
+    def set_namespace (self, namespace):
+        """ Replace the namespace commands run in
+
+        namespace is a module, or a dict whose items go into a new
+        __main__ module.
+        """
+
+        if not isinstance (namespace, types.ModuleType):
+            module = types.ModuleType ('__main__')
+            module.__dict__.update (namespace)
+            namespace = module
+        self.main_module = namespace
+        self.namespace = namespace.__dict__
+        self.namespace['__history__'] = self.history
+        self.namespace['__stats__'] = self.stats
+        self.cell_runs = {}
+
+
+
+# =============================================================================
+class HeadlessConsole (ConsoleCore):
+    """ Console working on plain streams, without any toolkit
+
+    Commands are read one line at a time from source and the output,
+    prompts included, is written to sink. Calls posted from other threads
+    are queued and run by the loop in interact, or by the trace function
+    while a command runs on the main thread.
+    """
+
+    def __init__ (self, namespace, source=None, sink=None, threaded=False,
+                  quit_handler=None):
+        """ Initialize console, source and sink default to the real
+        standard input and output """
+
+        self.source = source or sys.stdin
+        self.sink = sink or sys.stdout
+        self.calls = deque()
+        self.wakeup = threading.Event()
+        self.quitting = False
+        ConsoleCore.__init__ (self, namespace, quit_handler, threaded)
+
+
+    def write (self, line, style=None):
+        """ Write a line, styles are ignored """
+
+        self.flush_output()
+        self.sink.write (line)
+        self.sink.flush()
+
+
+    def write_runs (self, runs):
+        """ Write queued output runs """
+
+        for style, chunks in runs:
+            self.sink.write (''.join (chunks))
+        self.sink.flush()
+
+
+    def process_events (self):
+        """ Run the queued calls """
+
+        while self.calls:
+            func, args = self.calls.popleft()
+            func (*args)
+
+
+    def wait_events (self):
+        """ Wait for queued calls and run them """
+
+        self.wakeup.wait()
+        self.wakeup.clear()
+        self.process_events()
+
+
+    def post (self, func, *args):
+        """ Queue a call for the main thread """
+
+        self.calls.append ((func, args))
+        self.wakeup.set()
+
+
+    def call_later (self, delay, func):
+        """ Queue a call for the main thread after delay seconds """
+
+        timer = threading.Timer (delay, self.post, (func,))
+        timer.daemon = True
+        timer.start()
+
+
+    def schedule_flush (self):
+        """ Queue a flush for the main thread """
+
+        self.post (self.on_flush_timeout)
+        return True
+
+
+    def cancel_flush (self, source):
+        """ Nothing to do, the queued flush finds no output """
+
+        pass
+
+
+    def read_line (self):
+        """ Read the next line from source, None at the end """
+
+        line = self.source.readline()
+        if not line:
+            return None
+        return line.rstrip ('\n')
+
+
+    def wait_input (self):
+        """ Read the line asked for by the command from source """
+
+        line = self.read_line()
+        self.input_mode = False
+        if line is None:
+            self.closed = True
+        else:
+            self.input = line
+
+
+    def quit (self, *args):
+        """ Default handler on quit, interact returns """
+
+        self.quitting = True
+        return True
+
+
+    def interact (self, filename=None, profile=False):
+        """ Run filename if any, then the commands read from source until
+        its end or until the console quits """
+
+        if filename:
+            self.open (filename, profile)
+        else:
+            self.prompt1()
+        while not self.quitting:
+            if self.input_mode:
+                # The worker thread waits for a line
+                self.wait_input()
+                self.end_input()
+            elif self.running:
+                self.wait_events()
+            else:
+                line = self.read_line()
+                if line is None:
+                    break
+                self.push ([line])
+        self.close_input()
+        self.flush_output()
+
+
+def new_namespace ():
+    """ Return a fresh namespace to run a module in """
+
+    return {'__builtins__': __builtins__,
+            '__name__': '__main__',
+            '__doc__': None}
+
+
+def first_prompt_handler (console, trace_startup=False, exit_at_prompt=False):
+    """ Return a ready_handler reporting the startup phases and quitting
+    at the first prompt, as asked on the command line """
+
+    def on_first_prompt ():
+        console.ready_handler = None
+        if trace_startup:
+            startuptrace.mark ('first prompt')
+            sys.stderr.write (startuptrace.report())
+            startuptrace.stop()
+        if exit_at_prompt:
+            console.quit()
+    return on_first_prompt
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser (usage='%prog [options] [filename]')
+    parser.add_option ('--threaded', action='store_true',
+                       default=consolesettings.get('threaded_execution'),
+                       help='run commands on a worker thread')
+    parser.add_option ('--no-threaded', action='store_false', dest='threaded',
+                       help='run commands on the main thread')
+    parser.add_option ('--profile', action='store_true', default=False,
+                       help='run the module under the sampling profiler')
+    parser.add_option ('--exit-at-prompt', action='store_true', default=False,
+                       help='exit at the first prompt, used to time startup')
+    parser.add_option ('--trace-startup', action='store_true', default=False,
+                       help='print the time taken by each startup phase')
+    options, args = parser.parse_args()
+
+    console = HeadlessConsole (new_namespace(), threaded = options.threaded)
+    startuptrace.mark ('console')
+    if options.exit_at_prompt or options.trace_startup:
+        console.ready_handler = first_prompt_handler (
+            console, options.trace_startup, options.exit_at_prompt)
+    filename = None
+    if args:
+        filename = args[0]
+    console.interact (filename, options.profile)
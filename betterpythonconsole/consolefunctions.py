@@ -18,34 +18,145 @@
 #    Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 """Core Functions for Gedit to interact with the Python Console. """
 
+import os
+import re
 import sys
+import errno
+import codecs
+import fcntl
+import socket
+import textwrap
 from gi.repository import Gtk
 from gi.repository import GObject
 import subprocess
 
+import consolesettings
+import consoleipc
+import consolesupervisor
+from statementchecker import StatementChecker
+
 # Insert a new item in the Tools menu
 UI_STR = """<ui>
   <menubar name="MenuBar">
     <menu name="ToolsMenu" action="Tools">
       <placeholder name="ToolsOps_2">
         <menuitem name="BetterConsole" action="BetterConsole"/>
+        <menuitem name="BetterConsoleProfile" action="BetterConsoleProfile"/>
+        <menuitem name="BetterConsoleSend" action="BetterConsoleSend"/>
       </placeholder>
     </menu>
   </menubar>
 </ui>
 """
+# Reads done per wakeup of an output watch, so a flood of native output
+# can not starve the gedit main loop
+OUTPUT_READS = 16
+OUTPUT_CHUNK = 65536
+
+# Lines at the top level which carry on the statement above them
+CONTINUATION_RE = re.compile(r'(else|elif|except|finally)\b')
+
+
+def enclosing_block(lines, row):
+    """Return the first and last line numbers of the top level statement
+    holding line row, with its decorators and without the blank lines and
+    comments following it."""
+    checker = StatementChecker()
+    starts = []
+    for number, line in enumerate(lines):
+        if (not checker.is_open() and line[:1].strip()
+                and not line.startswith('#')
+                and not CONTINUATION_RE.match(line)):
+            starts.append(number)
+        checker.push(line)
+    before = [i for i, start in enumerate(starts) if start <= row]
+    if not before:
+        return 0, 0
+    i = before[-1]
+    while i > 0 and lines[starts[i - 1]].startswith('@'):
+        i -= 1
+    first = starts[i]
+    last = len(lines) - 1
+    for j in range(i + 1, len(starts)):
+        if starts[j] > row and not lines[starts[j - 1]].startswith('@'):
+            last = starts[j] - 1
+            break
+    while last > max(first, row) and (not lines[last].strip()
+                                      or lines[last].startswith('#')):
+        last -= 1
+    return first, last
+
+
+class OutputLog(Gtk.ScrolledWindow):
+    """Bottom panel showing what the consoles write to their real stdout
+    and stderr, e.g. C extensions or subprocesses. Only the last max_chars
+    characters are kept."""
+
+    def __init__(self, max_chars):
+        Gtk.ScrolledWindow.__init__(self)
+        self.set_policy(Gtk.PolicyType.AUTOMATIC, Gtk.PolicyType.AUTOMATIC)
+        self.max_chars = max_chars
+        self.text = Gtk.TextView()
+        self.text.set_editable(False)
+        self.text.set_cursor_visible(False)
+        self.buffer = self.text.get_buffer()
+        self.add(self.text)
+        self.show_all()
+
+    def append(self, data):
+        """Append text at the end of the log, trimming its start."""
+        self.buffer.insert(self.buffer.get_end_iter(), data)
+        excess = self.buffer.get_char_count() - self.max_chars
+        if excess > 0:
+            self.buffer.delete(self.buffer.get_start_iter(),
+                               self.buffer.get_iter_at_offset(excess))
+        self.text.scroll_to_iter(self.buffer.get_end_iter(), 0, False, 0, 0)
+
+
 class BetterConsoleHelper:
     """Provides interaction with Gedit."""
     def __init__(self, plugin, window, consolepath):
         self._window = window
         self._plugin = plugin
         self._consolepath = consolepath
+        self._server = None
+        self._server_socket = consoleipc.socket_path(
+            'server-%d-%d' % (os.getpid(), id(window)))
+        self._zygote = None
+        self._zygote_preload = None
+        self._zygote_socket = consoleipc.socket_path(
+            'zygote-%d-%d' % (os.getpid(), id(window)))
+        # fd -> (watch, process) of the console outputs being read
+        self._output_watches = {}
+        self._output_log = OutputLog(consolesettings.get('output_log_bytes'))
+        image = Gtk.Image.new_from_stock(Gtk.STOCK_EXECUTE, Gtk.IconSize.MENU)
+        self._window.get_bottom_panel().add_item(
+            self._output_log, "BetterConsoleOutput", _("Console Output"),
+            image)
+        self._supervisor = consolesupervisor.ConsoleSupervisor(
+            consolesettings.get('console_memory_cap_mb'),
+            consolesettings.get('console_idle_seconds'),
+            lambda message: self.send_staus_message(message, "supervisor"))
+        image = Gtk.Image.new_from_stock(Gtk.STOCK_EXECUTE, Gtk.IconSize.MENU)
+        self._window.get_bottom_panel().add_item(
+            self._supervisor, "BetterConsoleProcesses", _("Consoles"), image)
         # Insert menu items
         self._insert_menu()
 
     def deactivate(self):
         """Remove any installed menu items from the Gedit Menu."""
         self._remove_menu()
+        self.stop_console_server()
+        self.stop_zygote()
+        # Nothing reads the output of the consoles left running any more,
+        # close the pipes so they get EPIPE rather than block once full
+        for watch, process, decoder in self._output_watches.values():
+            GObject.source_remove(watch)
+            process.stdout.close()
+        self._output_watches = {}
+        self._window.get_bottom_panel().remove_item(self._output_log)
+        self._supervisor.stop()
+        self._window.get_bottom_panel().remove_item(self._supervisor)
 
         self._window = None
         self._plugin = None
@@ -60,7 +171,17 @@ class BetterConsoleHelper:
         self._action_group = Gtk.ActionGroup("BetterConsolePluginActions")
         self._action_group.add_actions([("BetterConsole", None, _("Run Module"),
                                          'F5', _("Run file in Python Console"),
-                                         self.on_clear_document_activate)])
+                                         self.on_clear_document_activate),
+                                        ("BetterConsoleProfile", None,
+                                         _("Profile Module"), '<Shift>F5',
+                                         _("Profile file in Python Console"),
+                                         self.on_profile_document_activate),
+                                        ("BetterConsoleSend", None,
+                                         _("Send to Console"),
+                                         '<Control>Return',
+                                         _("Run the selection or the current "
+                                           "block in the last used console"),
+                                         self.on_send_activate)])
 
         # Insert the action group
         manager.insert_action_group(self._action_group, -1)
@@ -90,7 +211,63 @@ class BetterConsoleHelper:
 
     def on_clear_document_activate(self, action):
         """Menu activate handler,
-        i.e. this is what happens when someone clicks Run Module.
+        i.e. this is what happens when someone clicks Run Module."""
+        self.run_active_document()
+
+    def on_profile_document_activate(self, action):
+        """Menu activate handler for Profile Module."""
+        self.run_active_document(profile=True)
+
+    def on_send_activate(self, action):
+        """Menu activate handler for Send to Console."""
+        self.send_to_console()
+
+    def send_to_console(self):
+        """Run the selection, or the top level block around the cursor, of
+        the active document in a running console. It runs in the console
+        namespace, nothing is saved or started."""
+        doc = self._window.get_active_document()
+        if not doc:
+            return
+        if doc.get_has_selection():
+            start, end = doc.get_selection_bounds()
+            if start.get_line() != end.get_line():
+                start.set_line_offset(0)
+            first = start.get_line() + 1
+            source = textwrap.dedent(doc.get_text(start, end, True))
+        else:
+            text = doc.get_text(doc.get_start_iter(), doc.get_end_iter(),
+                                True)
+            lines = text.split('\n')
+            row = doc.get_iter_at_mark(doc.get_insert()).get_line()
+            first, last = enclosing_block(lines, row)
+            source = '\n'.join(lines[first:last + 1])
+            first = first + 1
+        if not source.strip():
+            return
+        request = {'cmd': 'exec', 'source': source, 'line': first,
+                   'filename': not doc.is_untitled()
+                   and doc.get_uri_for_display() or '<editor>'}
+
+        selected = self._supervisor.selected_pid()
+        pids = selected and [selected] or self._supervisor.console_pids()
+        for path in consoleipc.console_sockets(pids):
+            try:
+                reply = consoleipc.send_request(path, request, timeout=1.0)
+            except (socket.error, IOError, ValueError):
+                continue
+            if reply.get('ok'):
+                message = "Sent lines %d-%d to the console." % (
+                    first, first + source.rstrip('\n').count('\n'))
+            else:
+                message = reply.get('error', "The console refused the code.")
+            self.send_staus_message(message, "send_to_console")
+            return
+        self.send_staus_message("There is no console to send the code to, "
+                                "run the module first.", "send_to_console")
+
+    def run_active_document(self, profile=False):
+        """Run (or profile) the active document in a console.
         Contains sanity checks which is against the Zen of Python."""
         # Is there even a document?
         doc = self._window.get_active_document()
@@ -123,18 +300,156 @@ class BetterConsoleHelper:
             
         # Everything is fine
         else:
-            self.launch_python_console(doc.get_uri_for_display())
+            self.launch_python_console(doc.get_uri_for_display(), profile)
             mes_id = "upforit"
             message = "The module " + doc.get_short_name_for_display() + \
-            " has been executed."
+            (profile and " is being profiled." or " has been executed.")
             self.send_staus_message(message, mes_id)
                
-    def launch_python_console(self, filename):
+    def launch_python_console(self, filename, profile=False):
         """Launch a console."""
-        interpreter_name = "python2"
-        fullpath = self._consolepath + "/consoleinterface.py"
-        run_command = [interpreter_name, fullpath, filename]
-        p1 = subprocess.Popen(run_command, stdout=subprocess.PIPE)
+        if consolesettings.get('console_server'):
+            self.run_in_console_server(filename, profile)
+        elif consolesettings.get('zygote'):
+            self.run_in_zygote(filename, profile)
+        elif profile:
+            self.spawn_console(['--profile', filename])
+        else:
+            self.spawn_console([filename])
+
+    def spawn_console(self, args, script="consoleinterface.py", label=None,
+                      forks=False):
+        """Start a console process with the given arguments, tracked by
+        the supervisor as label (by default the name of the file run)."""
+        interpreter_name = consolesettings.get('interpreter')
+        fullpath = self._consolepath + "/" + script
+        # Resolved here, where gconf is already loaded, so the console
+        # does not have to before showing its window
+        font = ['--font', consolesettings.editor_font()]
+        run_command = [interpreter_name, fullpath] + font + args
+        process = subprocess.Popen(run_command, stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT)
+        # A template or server process is replaced once this changes
+        process.interpreter = interpreter_name
+        self.watch_output(process)
+        self._supervisor.track(process, label or os.path.basename(args[-1]),
+                               forks)
+        return process
+
+    def watch_output(self, process):
+        """Read the process output from the main loop as it comes, so the
+        pipe never fills up and blocks the console."""
+        fd = process.stdout.fileno()
+        flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+        fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        watch = GObject.io_add_watch(
+            fd, GObject.IO_IN | GObject.IO_HUP | GObject.IO_ERR,
+            self.on_console_output, process)
+        # A character split between two reads is decoded once complete
+        decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        self._output_watches[fd] = (watch, process, decoder)
+
+    def on_console_output(self, fd, condition, process):
+        """Output watch handler, moves what is available to the log."""
+        chunks = []
+        eof = False
+        for i in range(OUTPUT_READS):
+            try:
+                data = os.read(fd, OUTPUT_CHUNK)
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                eof = e.errno != errno.EAGAIN
+                break
+            if not data:
+                eof = True
+                break
+            chunks.append(data)
+        decoder = self._output_watches[fd][2]
+        text = decoder.decode(b''.join(chunks), eof)
+        if text:
+            self._output_log.append(text)
+        if eof:
+            del self._output_watches[fd]
+            process.stdout.close()
+            return False
+        return True
+
+    def reusable(self, process):
+        """Tell whether a template or server process is alive and runs the
+        interpreter set."""
+        return (self._supervisor.alive(process) and
+                process.interpreter == consolesettings.get('interpreter'))
+
+    def run_in_console_server(self, filename, profile=False):
+        """Run the file in this window's console server, starting the
+        server (with the file as its first run) if it is not running."""
+        if self.reusable(self._server):
+            request = {'cmd': 'run', 'filename': filename, 'profile': profile,
+                       'font': consolesettings.editor_font(),
+                       'namespace': consolesettings.get('server_namespace'),
+                       'window': consolesettings.get('server_window')}
+            try:
+                reply = consoleipc.send_request(self._server_socket, request)
+                if reply.get('queued'):
+                    self.send_staus_message(
+                        "The console is busy, the module runs once it is "
+                        "done.", "run_document")
+                return
+            except (socket.error, IOError, ValueError):
+                # The server is wedged, replace it
+                pass
+        self.stop_console_server()
+        args = ['--server', self._server_socket, filename]
+        if profile:
+            args.insert(0, '--profile')
+        self._server = self.spawn_console(args, label=_("console server"))
+
+    def stop_console_server(self):
+        """Ask the console server to quit."""
+        if self._server is None:
+            return
+        if self._supervisor.alive(self._server):
+            try:
+                consoleipc.send_request(self._server_socket, {'cmd': 'quit'})
+            except (socket.error, IOError, ValueError):
+                self._server.terminate()
+        self._server = None
+
+    def run_in_zygote(self, filename, profile=False):
+        """Fork a console for the file from the template process. The
+        template is (re)started, running the file as its first console,
+        when it is not running or the preload list has changed."""
+        preload = consolesettings.get('preload_modules')
+        if self.reusable(self._zygote) and preload == self._zygote_preload:
+            request = {'cmd': 'run', 'filename': filename, 'profile': profile,
+                       'font': consolesettings.editor_font()}
+            try:
+                reply = consoleipc.send_request(self._zygote_socket, request)
+                if reply.get('pid'):
+                    self._supervisor.adopt(reply['pid'],
+                                           os.path.basename(filename))
+                return
+            except (socket.error, IOError, ValueError):
+                pass
+        self.stop_zygote()
+        self._zygote_preload = preload
+        args = ['--preload', preload, self._zygote_socket, filename]
+        if profile:
+            args.insert(0, '--profile')
+        self._zygote = self.spawn_console(args, "consolezygote.py",
+                                          _("console template"), forks=True)
+
+    def stop_zygote(self):
+        """Ask the template process to quit, its consoles keep running."""
+        if self._zygote is None:
+            return
+        if self._supervisor.alive(self._zygote):
+            try:
+                consoleipc.send_request(self._zygote_socket, {'cmd': 'quit'})
+            except (socket.error, IOError, ValueError):
+                self._zygote.terminate()
+        self._zygote = None
 
     def send_staus_message(self, message, mes_id):
         """Put a message on the Status bar."""
@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+
+#    This file is part of the Better Python Console Plugin for Gedit
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+"""Command history shared by all the consoles.
+
+Every console appends its commands to the same file, one entry per line,
+and the file is compacted once it grows past its size limit. Before a
+console appends or moves through its history, it reads the entries the
+other consoles appended since, from where it last stopped. In memory
+the entries are also joined into a single string, which makes substring
+and prefix searches a single str.rfind/str.find call instead of a loop
+over hundreds of thousands of entries. The entries added since the last
+search are joined to it by the next one, and the lines of a paste are
+written to the file at once.
+"""
+
+import os
+import sys
+from bisect import bisect_right
+
+# Separates the entries in the search text, it can not appear in a query
+SEP = '\0'
+
+
+def default_history_file():
+    """Return the default location of the history file."""
+    base = os.environ.get('XDG_DATA_HOME') or \
+        os.path.join(os.path.expanduser('~'), '.local', 'share')
+    return os.path.join(base, 'betterpythonconsole', 'history')
+
+
+def encode(entry):
+    """Encode an entry as a single line of the history file."""
+    return entry.replace('\\', '\\\\').replace('\n', '\\n') + '\n'
+
+
+def decode(line):
+    """Decode a line of the history file."""
+    line = line.rstrip('\n')
+    if '\\' not in line:
+        return line
+    return line.replace('\\\\', '\0').replace('\\n', '\n').replace('\0', '\\')
+
+
+def open_text(path, mode):
+    """Open a text file holding the same kind of str as the GTK buffer."""
+    if sys.version_info[0] >= 3:
+        return open(path, mode, encoding='utf-8', errors='replace')
+    return open(path, mode)
+
+
+class HistoryStore:
+    """Indexed, size bounded, on-disk command history.
+
+    path is None for a history which is only kept in memory. At most size
+    entries are kept; the file is rewritten with the last size entries
+    once it holds half as many more."""
+
+    def __init__(self, path=None, size=100000):
+        self.path = path
+        self.size = size
+        self.entries = []
+        self.text = SEP
+        # Entries not joined to text yet, and the length text will have
+        self.tail = []
+        self.length = 1
+        self.starts = []
+        self.file_lines = 0
+        # Identity and size of the history file as last read
+        self.file_id = None
+        self.file_size = 0
+        # Entries trimmed from the front and full reloads so far, for the
+        # positions kept by History to follow them
+        self.dropped = 0
+        self.reloads = 0
+        if path:
+            self.load()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getitem__(self, index):
+        return self.entries[index]
+
+    def index(self, entries):
+        """Replace the entries and rebuild the search text."""
+        self.entries = entries
+        self.starts = []
+        offset = 1
+        for entry in entries:
+            self.starts.append(offset)
+            offset = offset + len(entry) + 1
+        self.text = SEP + SEP.join(entries) + (SEP if entries else '')
+        self.tail = []
+        self.length = len(self.text)
+
+    def search_text(self):
+        """Return the search text, joining the entries added since."""
+        if self.tail:
+            self.text = self.text + SEP.join(self.tail) + SEP
+            self.tail = []
+        return self.text
+
+    def read(self, offset=0):
+        """Return the entries of the history file from byte offset on, and
+        the offset of the end of the last complete line read."""
+        try:
+            f = open(self.path, 'rb')
+        except (IOError, OSError):
+            return [], offset
+        try:
+            f.seek(offset)
+            data = f.read()
+        finally:
+            f.close()
+        # A line being written by another console is read next time
+        end = data.rfind(b'\n') + 1
+        text = data[:end]
+        if sys.version_info[0] >= 3:
+            text = text.decode('utf-8', 'replace')
+        return [decode(line) for line in text.split('\n')[:-1]], offset + end
+
+    def stat(self):
+        """Return the identity and size of the history file, or None."""
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_dev, st.st_ino), st.st_size
+
+    def load(self):
+        """Load the history file."""
+        current = self.stat()
+        entries, self.file_size = self.read()
+        self.file_id = current and current[0]
+        self.file_lines = len(entries)
+        self.index(entries[-self.size:])
+
+    def refresh(self):
+        """Add the entries other consoles appended to the history file
+        since it was last read, or reload it once they compacted it."""
+        if not self.path:
+            return
+        current = self.stat()
+        if current is None or current == (self.file_id, self.file_size):
+            return
+        if current[0] != self.file_id or current[1] < self.file_size:
+            self.load()
+            self.reloads = self.reloads + 1
+            return
+        entries, self.file_size = self.read(self.file_size)
+        self.file_lines = self.file_lines + len(entries)
+        self.add(entries)
+
+    def add(self, entries):
+        """Add entries in memory, trimming the oldest ones once there
+        are half as many more as kept."""
+        for entry in entries:
+            self.starts.append(self.length)
+            self.length = self.length + len(entry) + 1
+        self.entries.extend(entries)
+        self.tail.extend(entries)
+        if len(self.entries) > self.size * 3 // 2:
+            self.dropped = self.dropped + len(self.entries) - self.size
+            self.index(self.entries[-self.size:])
+
+    def append(self, entry):
+        """Add an entry, in memory and at the end of the history file."""
+        self.extend([entry])
+
+    def extend(self, entries):
+        """Add entries, in memory and at the end of the history file, with
+        a single write."""
+        entries = [entry.replace(SEP, '') for entry in entries]
+        self.refresh()
+        self.add(entries)
+        if not self.path:
+            return
+        try:
+            directory = os.path.dirname(self.path)
+            if not os.path.isdir(directory):
+                os.makedirs(directory, 0o700)
+            f = open_text(self.path, 'a')
+            try:
+                f.write(''.join([encode(entry) for entry in entries]))
+                f.flush()
+                st = os.fstat(f.fileno())
+            finally:
+                f.close()
+        except (IOError, OSError):
+            return
+        self.file_id = (st.st_dev, st.st_ino)
+        self.file_size = st.st_size
+        self.file_lines = self.file_lines + len(entries)
+        if self.file_lines > self.size * 3 // 2:
+            self.compact()
+
+    def compact(self):
+        """Rewrite the history file with its last size entries only."""
+        entries = self.read()[0][-self.size:]
+        tmp = '%s.%d' % (self.path, os.getpid())
+        try:
+            f = open_text(tmp, 'w')
+            try:
+                f.writelines([encode(entry) for entry in entries])
+            finally:
+                f.close()
+            os.rename(tmp, self.path)
+        except (IOError, OSError):
+            return
+        self.file_lines = len(entries)
+        current = self.stat()
+        if current is not None:
+            self.file_id, self.file_size = current
+
+    def entry_at(self, offset):
+        """Return the index of the entry holding the text offset."""
+        return bisect_right(self.starts, offset) - 1
+
+    def end_of(self, before):
+        """Return the text offset where the entries before the one at
+        index before end."""
+        if before is None or before >= len(self.entries):
+            return self.length - 1
+        return self.starts[before] - 1
+
+    def search(self, query, before=None):
+        """Return the index of the last entry before the one at index
+        before which contains query, or None."""
+        if not query:
+            return None
+        pos = self.search_text().rfind(query, 0, self.end_of(before))
+        if pos < 0:
+            return None
+        return self.entry_at(pos)
+
+    def search_prefix(self, prefix, before=None):
+        """Return the index of the last entry before the one at index
+        before which starts with prefix, or None."""
+        pos = self.search_text().rfind(SEP + prefix, 0,
+                                       self.end_of(before))
+        if pos < 0:
+            return None
+        return self.entry_at(pos + 1)
+
+    def search_prefix_forward(self, prefix, after):
+        """Return the index of the first entry after the one at index
+        after which starts with prefix, or None."""
+        if after + 1 >= len(self.entries):
+            return None
+        pos = self.search_text().find(SEP + prefix, self.starts[after + 1] - 1)
+        if pos < 0 or pos + 1 >= self.length:
+            return None
+        return self.entry_at(pos + 1)
@@ -51,167 +51,59 @@ __author__  = 'Nicolas Rougier'
 __email__   = 'Nicolas.Rougier@loria.fr'
 
 
-import os.path, sys, traceback
+import os.path, sys, optparse
+from collections import OrderedDict, deque
 
-from gi.repository import Gtk, GConf, Pango, GObject, Gdk
+import startuptrace
+import consolesettings
+import completion
+import highlight
+from consolecore import ConsoleCore, new_namespace, first_prompt_handler
+from consolecore import any_running
+from resultrepr import Expansion
+
+from gi.repository import Gtk, Pango, GObject, GLib, Gdk
+
+GObject.threads_init()
+startuptrace.mark ('gtk imports')
 
 stdout = sys.stdout
-if not hasattr(sys, 'ps1'):
-    sys.ps1 = '>>> '
-if not hasattr(sys, 'ps2'):
-    sys.ps2 = '... '
 
+# Queued output is written to the buffer at most once per frame (ms)
+FLUSH_INTERVAL = 16
 
-# =============================================================================
-class gtkoutfile:
-    """
-    A fake output file object.  It sends output to a GTK TextView widget,
-    and if asked for a file number, returns one set on instance creation
-    """
-    
-    def __init__(self, console, fn, font):
-        self.fn = fn
-        self.console = console
-        #self.__b = w.get_buffer()
-        #self.__ins = self.__b.get_mark('insert')
-        self.font = font
-    def close(self): pass
-    flush = close
-    def fileno(self):    return self.fn
-    def isatty(self):    return False
-    def read(self, a):   return ''
-    def readline(self):  return ''
-    def readlines(self): return []
-    def write(self, s):
-        self.console.write (s, self.font)
-    def writelines(self, l):
-        for s in l:
-            self.console.write (s, self.font)
-    def seek(self, a):   raise IOError(29, 'Illegal seek')
-    def tell(self):      raise IOError(29, 'Illegal seek')
-    truncate = tell
+# Fraction of the scrollback limit kept after a trim, so that trimming
+# happens in chunks rather than on every write
+SCROLLBACK_KEEP = 0.9
 
+# Results which can still be expanded, the oldest ones stay truncated
+MAX_EXPANSIONS = 100
 
-# =============================================================================
-class gtkinfile:
-    """
-    A fake input file object.  It receives input from a GTK TextView widget,
-    and if asked for a file number, returns one set on instance creation
-    """
-    
-    def __init__(self, console, fn):
-        self.fn = fn
-        self.console = console
-    def close(self): pass
-    flush = close
-    def fileno(self):    return self.fn
-    def isatty(self):    return False
-    def read(self, a):   return self.readline()
-    def readline(self):
-        self.console.input_mode = True
-        while self.console.input_mode:
-            while Gtk.events_pending():
-                Gtk.main_iteration()
-        s = self.console.input
-        self.console.input = ''
-        return s+'\n'
-    def readlines(self): return []
-    def write(self, s):  return None
-    def writelines(self, l): return None
-    def seek(self, a):   raise IOError(29, 'Illegal seek')
-    def tell(self):      raise IOError(29, 'Illegal seek')
-    truncate = tell
+# Check for the end of the running console of a server every (ms)
+QUEUE_INTERVAL = 100
 
 
 # =============================================================================
-class History:
-    """ Basic command history class
-    """
-    
-    def __init__ (self):
-        """ Initializes history """
-        
-        self.history = ['']
-        self.position = len (self.history)-1
-        
-    def prev (self, current):
-        """ Get previous command in history """
-        
-        if self.position > 0:
-            l = current
-            if len(l) > 0 and l[0] == '\n': l = l[1:]
-            if len(l) > 0 and l[-1] == '\n': l = l[:-1]
-            if self.position > 0:
-                if self.position == (len(self.history)-1):
-                    self.history[len(self.history)-1] = l
-                self.position = self.position - 1
-                return self.history[self.position]
-        return current
-        
-    def next (self, current):
-        """ Get next command in history """
-        
-        if self.position < len(self.history) - 1:
-            self.position = self.position + 1
-            return self.history[self.position]
-        return current
-    
-    def append (self, line):
-        """ Append a new command to history """
-        
-        self.position = len(self.history) - 1
-        if not len(line):
-            return
-        if ((self.position == 0) or (self.position > 0 and 
-                        line != self.history[self.position-1])):
-            self.history[self.position] = line
-            self.position = self.position + 1
-            self.history.append('')
-    
-    def open (self, filename):
-        """ Open an history file """
-        
-        file = open (filename)
-        self.history = []
-        for l in file:
-            self.history.append(l[:-1])
-        self.history.append('')
-        self.position = len(self.history)-1
-        file.close()
-
-    def save (self, filename):
-        """ Save history to a file """
-        
-        file = open (filename, 'w')
-        for l in self.history:
-            if len(l) > 0:
-                file.write(l+'\n')
-        file.close()
-        
-    def __repr__(self):
-        """ History representation """
-        
-        return self.history.__repr__()
-
+class Console (ConsoleCore, Gtk.ScrolledWindow):
+    """ Interactive GTK console class
 
+    The GTK front end of ConsoleCore, which does everything but drawing.
+    """
 
-# =============================================================================
-class Console (Gtk.ScrolledWindow):
-    """ Interactive GTK console class """
+    route_output = True
 
-    def __init__(self, namespace={}, quit_handler = None):
+    def __init__(self, namespace={}, quit_handler = None, threaded = False,
+                 font = None):
         """ Initialize console
+
+        If threaded is True, commands run on a worker thread and talk to
+        the GTK main loop through GObject.idle_add, otherwise they run on
+        the main thread with a trace function pumping GTK events. font is
+        normally passed by gedit, it is only looked up in gconf otherwise.
         """
         # Get font from gedit's entries in gconf
-        client = GConf.Client.get_default()
-        default_question = client.get_bool(
-            '/apps/gedit-2/preferences/editor/font/use_default_font')
-        if default_question == True:
-            userfont = client.get_string(
-                '/desktop/gnome/interface/font_name')
-        else: 
-            userfont = client.get_string(
-                '/apps/gedit-2/preferences/editor/font/editor_font')
+        userfont = font or consolesettings.editor_font()
+        startuptrace.mark ('font')
         
         # Setup scrolled window
         GObject.GObject.__init__(self)
@@ -243,32 +135,44 @@ class Console (Gtk.ScrolledWindow):
                 foreground='orange')
         self.buffer.create_tag ('center',
                 justification=Gtk.Justification.CENTER)
+        self.buffer.create_tag ('stats',
+                foreground='darkgrey', scale=0.8)
+
+        # Setup syntax highlighting, the tags (created last to take
+        # precedence over the ones above) are reused for every span
+        self.syntax_tags = {}
+        self.dirty_lines = None
+        self.highlight_source = None
+        self.input_quoted = False
+        if consolesettings.get('syntax_highlighting'):
+            for kind, colour in highlight.COLOURS.items():
+                self.syntax_tags[kind] = self.buffer.create_tag (
+                    None, foreground=colour)
+            self.buffer.connect_after ('insert-text', self.on_text_inserted)
+            self.buffer.connect_after ('delete-range', self.on_range_deleted)
         
         # Setup event handlers
         self.text.add_events(Gdk.EventMask.KEY_PRESS_MASK)
         self.text.connect ('button-press-event', self.on_button_press)
         self.text.connect ('key-press-event', self.on_key_pressed)
         self.text.connect ('drag-data-received', self.on_drag_data_received)
+        self.connect ('destroy', self.on_destroy)
         self.add(self.text)
         
         # Internal setup
-        self.namespace = namespace
-        self.cmd = ''
-        self.input = ''
-        self.input_mode = False
+        ConsoleCore.__init__ (self, namespace, quit_handler, threaded)
         self.linestart = 0
-        self.quit_handler = self.quit
-        if quit_handler:
-            self.quit_handler = quit_handler
-
-        # Setup hooks for standard output.
-        self.stdout = gtkoutfile (self, sys.stdout.fileno(), 'normal')
-        self.stderr = gtkoutfile (self, sys.stderr.fileno(), 'error')
-        self.stdin  = gtkinfile (self, sys.stdin.fileno())
-
-        # Setup command history
-        self.history = History()
-        self.namespace['__history__'] = self.history
+        self.search_query = None
+
+        # Setup scrollback limits
+        self.scrollback_lines = consolesettings.get('scrollback_lines')
+        self.scrollback_bytes = consolesettings.get('scrollback_bytes')
+        self.scrollback_spill = consolesettings.get('scrollback_spill')
+        if self.scrollback_spill:
+            self.scrollback_spill = self.scrollback_spill.replace (
+                '%p', str(os.getpid()))
+        self.trimmed_chars = 0
+        self.expansions = OrderedDict()
         self.show_all()
 
 
@@ -284,23 +188,10 @@ class Console (Gtk.ScrolledWindow):
         self.prompt1()
 
 
-    def prompt1 (self):
-        """ Display normal prompt """
-        
-        self.prompt = sys.ps1
-        self.write (self.prompt, 'prompt')
-
-
-    def prompt2 (self):
-        """ Display continuation prompt """
-        
-        self.prompt = sys.ps2
-        self.write (self.prompt, 'prompt')
-
-
     def clear (self):
         """ Clear text buffer & view """
         
+        self.flush_output()
         line = self.current_line()
         self.buffer.delete (
             self.buffer.get_start_iter(), self.buffer.get_end_iter())
@@ -308,14 +199,228 @@ class Console (Gtk.ScrolledWindow):
         self.write (line)
 
 
+    def schedule_flush (self):
+        """ Flush the queued output at most once per frame """
+
+        return GObject.timeout_add (FLUSH_INTERVAL, self.on_flush_timeout)
+
+
+    def cancel_flush (self, source):
+        """ Remove the flush timer """
+
+        GObject.source_remove (source)
+
+
+    def write_runs (self, runs):
+        """ Write queued output to the buffer and scroll once """
+
+        for style, chunks in runs:
+            end = self.buffer.get_end_iter()
+            if style == None:
+                self.buffer.insert (end, ''.join (chunks))
+            elif isinstance (style, Expansion):
+                self.insert_expansion (end, style)
+            else:
+                offset = end.get_offset()
+                text = ''.join (chunks)
+                self.buffer.insert_with_tags_by_name (end, text, style)
+                if style == 'error' and self.syntax_tags:
+                    self.highlight_traceback (offset, text)
+        self.trim_scrollback()
+        self.text.scroll_mark_onscreen (self.buffer.get_insert())
+        self.linestart = self.buffer.get_end_iter().get_offset()
+
+
+    def on_text_inserted (self, buffer, iter, text, length):
+        """ Handler for text insertion, its lines need highlighting """
+
+        last = iter.get_line()
+        self.mark_dirty (last - text.count ('\n'), last)
+
+
+    def on_range_deleted (self, buffer, start, end):
+        """ Handler for text deletion, its line needs highlighting """
+
+        line = start.get_line()
+        self.mark_dirty (line, line)
+
+
+    def mark_dirty (self, first, last):
+        """ Highlight lines first to last of the input before the next
+        frame is drawn """
+
+        if self.dirty_lines:
+            first = min (first, self.dirty_lines[0])
+            last = max (last, self.dirty_lines[1])
+        self.dirty_lines = (first, last)
+        if self.highlight_source is None:
+            self.highlight_source = GLib.idle_add (
+                self.highlight_input, priority=GLib.PRIORITY_HIGH_IDLE)
+
+
+    def highlight_input (self):
+        """ Highlight the lines of the input changed since the last call
+
+        Only the changed lines are highlighted, the buffer before the input
+        is never looked at. When the input has a triple quoted string, the
+        lines after the changed ones are highlighted again as well.
+        """
+
+        self.highlight_source = None
+        first, last = self.dirty_lines
+        self.dirty_lines = None
+        if self.input_mode:
+            return False
+        start = self.buffer.get_iter_at_offset (self.linestart)
+        top = start.get_line()
+        bottom = self.buffer.get_line_count() - 1
+        first = max (first, top)
+        last = min (last, bottom)
+        if first > last:
+            return False
+
+        text = self.buffer.get_text (start, self.buffer.get_end_iter(), True)
+        if not isinstance (text, type (u'')):
+            text = text.decode ('utf-8', 'replace')
+        quoted = "'''" in text or '"""' in text
+        if quoted or self.input_quoted:
+            last = bottom
+        self.input_quoted = quoted
+        lines = text.split ('\n')
+        state = highlight.open_quote (lines[:first - top])
+
+        for number in range (first, last + 1):
+            if number == top:
+                line_start = start
+            else:
+                line_start = self.buffer.get_iter_at_line (number)
+            line_end = line_start.copy()
+            if not line_end.ends_line():
+                line_end.forward_to_line_end()
+            for tag in self.syntax_tags.values():
+                self.buffer.remove_tag (tag, line_start, line_end)
+            spans, state = highlight.highlight (lines[number - top], state)
+            self.apply_spans (line_start.get_offset(), spans)
+        return False
+
+
+    def highlight_traceback (self, offset, text):
+        """ Highlight the frames of a traceback written at offset """
+
+        if not isinstance (text, type (u'')):
+            text = text.decode ('utf-8', 'replace')
+        lines = text.split ('\n')
+        starts = [0]
+        for line in lines:
+            starts.append (starts[-1] + len (line) + 1)
+        for number, begin, end, kind in highlight.traceback_spans (lines):
+            base = offset + starts[number]
+            self.apply_spans (base, [(begin, end, kind)])
+
+
+    def apply_spans (self, offset, spans):
+        """ Tag the spans (start, end, kind) of a line starting at offset """
+
+        at = self.buffer.get_iter_at_offset
+        for begin, end, kind in spans:
+            self.buffer.apply_tag (self.syntax_tags[kind], at (offset + begin),
+                                   at (offset + end))
+
+
+    def insert_expansion (self, iter, expansion):
+        """ Insert the label of the rest of a result, as a link showing
+        its next page when clicked """
+
+        table = self.buffer.get_tag_table()
+        tag = self.buffer.create_tag (None, underline=Pango.Underline.SINGLE)
+        tag.connect ('event', self.on_expansion_event)
+        self.expansions[tag] = expansion
+        if len (self.expansions) > MAX_EXPANSIONS:
+            table.remove (self.expansions.popitem (last=False)[0])
+        self.buffer.insert_with_tags (iter, expansion.label(), tag,
+                                      table.lookup ('normal'))
+
+
+    def on_expansion_event (self, tag, widget, event, iter):
+        """ Handler for the clicks on a result expansion link """
+
+        if (event.type != Gdk.EventType.BUTTON_PRESS or
+                event.get_button()[1] != 1):
+            return False
+        expansion = self.expansions.pop (tag, None)
+        if expansion is None:
+            return False
+        start = iter.copy()
+        if not start.begins_tag (tag):
+            start.backward_to_tag_toggle (tag)
+        end = iter.copy()
+        end.forward_to_tag_toggle (tag)
+        offset = start.get_offset()
+        chars = self.buffer.get_char_count()
+
+        text, rest = expansion.render()
+        self.buffer.delete (start, end)
+        iter = self.buffer.get_iter_at_offset (offset)
+        self.buffer.insert_with_tags_by_name (iter, text, 'normal')
+        if rest is not None:
+            self.insert_expansion (iter, rest)
+        if offset < self.linestart:
+            self.linestart += self.buffer.get_char_count() - chars
+        # The tag can not be removed while it is emitting this event
+        GObject.idle_add (self.buffer.get_tag_table().remove, tag)
+        return True
+
+
+    def trim_scrollback (self):
+        """ Drop the oldest lines once the scrollback limit is exceeded
+
+        Whole lines are removed down to SCROLLBACK_KEEP of the limit, the
+        current line is never touched. Removed text goes to the spill file
+        if there is one, and is accounted for in trimmed_chars.
+        """
+
+        lines = self.buffer.get_line_count()
+        chars = self.buffer.get_char_count()
+        cut = 0
+        if self.scrollback_lines and lines > self.scrollback_lines:
+            keep = int (self.scrollback_lines * SCROLLBACK_KEEP)
+            cut = self.buffer.get_iter_at_line (lines - keep).get_offset()
+        if self.scrollback_bytes and chars > self.scrollback_bytes:
+            keep = int (self.scrollback_bytes * SCROLLBACK_KEEP)
+            iter = self.buffer.get_iter_at_offset (chars - keep)
+            if not iter.starts_line():
+                iter.forward_line()
+            cut = max (cut, iter.get_offset())
+        cut = min (cut, self.buffer.get_iter_at_line (lines - 1).get_offset())
+        if cut <= 0:
+            return
+
+        start = self.buffer.get_start_iter()
+        end = self.buffer.get_iter_at_offset (cut)
+        if self.scrollback_spill:
+            try:
+                spill = open (self.scrollback_spill, 'a')
+                try:
+                    spill.write (self.buffer.get_text (start, end, True))
+                finally:
+                    spill.close()
+            except (IOError, OSError):
+                self.scrollback_spill = ''
+        self.buffer.delete (start, end)
+        self.trimmed_chars = self.trimmed_chars + cut
+        self.linestart = max (self.linestart - cut, 0)
+
+
     def write (self, line, style=None):
         """ Write a line using given style (if any) """
     
+        self.flush_output()
         start, end = self.text.get_buffer().get_bounds()
         if style == None:
             self.text.get_buffer().insert (end, line)
         else:
             self.text.get_buffer().insert_with_tags_by_name (end, line, style)
+        self.trim_scrollback()
         self.text.scroll_mark_onscreen (self.buffer.get_insert())
         self.linestart = self.buffer.get_end_iter().get_offset()
 
@@ -325,8 +430,9 @@ class Console (Gtk.ScrolledWindow):
         start, end = self.current_line_bounds()
         self.text.get_buffer().delete (start, end)
         l = self.linestart
+        trimmed = self.trimmed_chars
         self.write (line)
-        self.linestart = l
+        self.linestart = l - (self.trimmed_chars - trimmed)
 
 
     def current_line (self):
@@ -349,155 +455,132 @@ class Console (Gtk.ScrolledWindow):
         return start, end
 
 
-    def is_balanced (self, line):
-        """ Checks line balance for brace, bracket, parenthese and string quote
+    def current_input (self):
+        """ Get the text typed (or pasted) since the last prompt """
 
-        This helper function checks for the balance of brace, bracket,
-        parenthese and string quote. Any unbalanced line means to wait until
-        some other lines are fed to the console.
-        """
-        
-        s = line
-        s = filter(lambda x: x in '()[]{}"\'', s)
-        s = s.replace ("'''", "'")
-        s = s.replace ('"""', '"')
-        instring = False
-        brackets = {'(':')', '[':']', '{':'}', '"':'"', '\'':'\''}
-        stack = []
-        
-        while len(s):
-            if not instring:
-                if s[0] in ')]}':
-                    if stack and brackets[stack[-1]] == s[0]:
-                        del stack[-1]
-                    else:
-                        return False
-                elif s[0] in '"\'':
-                    if stack and brackets[stack[-1]] == s[0]:
-                        del stack[-1]
-                        instring = False
-                    else:
-                        stack.append(s[0])
-                        instring = True
-                else:
-                    stack.append(s[0])
-            else:
-                if s[0] in '"\'' and stack and brackets[stack[-1]] == s[0]:
-                    del stack[-1]
-                    instring = False
-            s = s[1:]
-        return len(stack) == 0
+        start = self.buffer.get_iter_at_offset (self.linestart)
+        end = self.buffer.get_end_iter()
+        return self.buffer.get_text (start, end, True)
 
 
     def eval (self):
-        """ Evaluate if current line is ready for execution """
+        """ Evaluate if current input is ready for execution
+
+        The input (there are several lines after a paste) is pushed to the
+        console engine, which runs it once the statement is complete.
+        """
         
-        l = self.current_line()
+        lines = self.current_input().split ('\n')
         self.write ('\n')
-        self.history.append (l)
         end = self.buffer.get_end_iter()
         self.buffer.place_cursor(end)
+        self.push (lines)
 
-        if l == '':
-            cmd = self.cmd
-            self.cmd = ''
-            self.execute (cmd)
-            self.prompt1()
-            return
 
-        self.cmd = self.cmd + l + '\n'
-        if not self.is_balanced (self.cmd):
-            self.prompt2()
+    def complete (self):
+        """ Complete the name before the cursor
+
+        The common part of the completions is inserted; when there is none
+        to insert, the completions are listed above a new prompt. Tab on a
+        blank line indents it.
+        """
+
+        start = self.buffer.get_iter_at_offset (self.linestart)
+        cursor = self.buffer.get_iter_at_mark (self.buffer.get_insert())
+        line = self.buffer.get_text (start, cursor, True).split ('\n')[-1]
+        if not line.strip():
+            self.buffer.insert_at_cursor ('    ')
             return
-        l = l.rstrip()
-        if len(l) > 0:
-            if l[-1] == ':' or l[-1] == '\\' or l[0] in ' \11':
-                self.prompt2()
-                return
-
-        cmd = self.cmd
-        self.cmd = ''
-        self.execute (cmd)
-        self.prompt1()
-        return
+        word, names = self.completions (line)
+        common = os.path.commonprefix (names)
+        if len(common) > len(word):
+            self.buffer.insert_at_cursor (common[len(word):])
+        elif len(names) > 1:
+            self.show_completions (names)
 
 
-    def idle (self, frame, event, arg):
-        """ Idle function to be used when running a command.
-        
-        This idle function is set as a trace function when executing some
-        commands, it allows to process gtk events even when executing code.
-        """
+    def run_source (self, source, filename='<editor>', first=1, done=None):
+        """ Run source sent from the editor, keeping the text typed at the
+        prompt for the next one """
+
+        if self.busy():
+            return False
+        typed = self.current_input()
+        start = self.buffer.get_iter_at_offset (self.linestart)
+        self.buffer.delete (start, self.buffer.get_end_iter())
+
+        def restore ():
+            self.buffer.insert (self.buffer.get_end_iter(), typed)
+            if done:
+                done()
+
+        return ConsoleCore.run_source (self, source, filename, first, restore)
+
+
+    def show_completions (self, names):
+        """ List names above a new prompt, keeping the input typed """
+
+        text = self.current_input()
+        cursor = self.buffer.get_iter_at_mark (self.buffer.get_insert())
+        offset = cursor.get_offset() - self.linestart
+        start = self.buffer.get_iter_at_offset (self.linestart)
+        self.buffer.delete (start, self.buffer.get_end_iter())
+        self.write ('\n' + completion.columns (names), 'script')
+        self.write (self.prompt, 'prompt')
+        self.buffer.insert (self.buffer.get_end_iter(), text)
+        cursor = self.buffer.get_iter_at_offset (self.linestart + offset)
+        self.buffer.place_cursor (cursor)
+        self.text.scroll_mark_onscreen (self.buffer.get_insert())
+
+
+    def process_events (self):
+        """ Process the pending GTK events """
         
         while Gtk.events_pending():
             Gtk.main_iteration()
-        return self.idle
 
 
-    def execute (self, cmd):
-        """ Execute a given command """
+    def post (self, func, *args):
+        """ Call func from the GTK main loop with GObject.idle_add """
 
-        sys.stdout, self.stdout = self.stdout, sys.stdout
-        sys.stderr, self.stderr = self.stderr, sys.stderr
-        sys.stdin,  self.stdin  = self.stdin,  sys.stdin
-        sys.settrace (self.idle)
+        def callback ():
+            func (*args)
+            return False
+        GObject.idle_add (callback)
 
-        try:
-            try:
-                r = eval (cmd, self.namespace, self.namespace)
-                
-                if r is not None:
-                    print(r)
-            except SyntaxError:
-                exec cmd in self.namespace
-        except:
-            if hasattr (sys, 'last_type') and sys.last_type == SystemExit:
-                self.quit_handler()
-            else:
-                try:
-                    info = sys.exc_info()
-                    tb = info[2]
-                    if tb:
-                        tb = tb.tb_next
-                    traceback.print_exception (info[0], info[1], tb)
-                except:
-                    sys.stderr, self.stderr = self.stderr, sys.stderr
-                    traceback.print_exc()
-        sys.settrace (None)
-        sys.stdout, self.stdout = self.stdout, sys.stdout
-        sys.stderr, self.stderr = self.stderr, sys.stderr
-        sys.stdin,  self.stdin  = self.stdin,  sys.stdin
-
-
-    def open (self, filename):
-        """ Open and execute a given filename """
-        
-        if not filename:
-            return
-        if not os.path.exists (filename):
-            dialog = Gtk.MessageDialog(
-                   None, Gtk.DialogFlags.DESTROY_WITH_PARENT,
-                   Gtk.MessageType.ERROR, Gtk.ButtonsType.OK,
-                   "Unable to open '%s', the file does not exist." % filename)
-            dialog.run()
-            dialog.destroy()
-            return
 
-        # By here we need to have the Path sorted out
-        # or we will be north of the river. 
-        # Does not matter if it has been called without a file.
-        sys.path.append(os.path.dirname(filename)) 
-        
-        f = open(filename)
+    def call_later (self, delay, func):
+        """ Call func from the GTK main loop after delay seconds """
+
+        GObject.timeout_add (int (delay * 1000), func)
+
+
+    def wait_input (self):
+        """ Run a nested main loop until the Return handler quits it """
+
+        self.input_loop = GLib.MainLoop()
         try:
-            self.write ("Executing '%s'\n\n" % filename, 'extern')
-#            for line in f:
-#                self.write ('\t'+line, 'script')
-            self.write ('\n')
-            self.execute ("exec(open('%s').read())" % filename)
-            self.prompt1()
+            self.input_loop.run()
         finally:
-            f.close()
+            self.input_loop = None
+
+
+    def report_missing (self, filename):
+        """ Tell that a module to run does not exist """
+
+        dialog = Gtk.MessageDialog(
+               None, Gtk.DialogFlags.DESTROY_WITH_PARENT,
+               Gtk.MessageType.ERROR, Gtk.ButtonsType.OK,
+               "Unable to open '%s', the file does not exist." % filename)
+        dialog.run()
+        dialog.destroy()
+
+
+    def on_destroy (self, widget):
+        """ Handler for the console destruction, pending reads get EOF """
+
+        self.close_input()
+
 
     def quit (self, *args):
         """ Default handler on quit """
@@ -523,6 +606,13 @@ class Console (Gtk.ScrolledWindow):
     def on_key_pressed (self, widget, event):
         """ Key pressed handler """
         
+        # Any key but Ctrl-R ends a reverse search
+        if not event.is_modifier and not (
+                event.get_state() & Gdk.ModifierType.CONTROL_MASK and
+                event.keyval in (Gdk.KEY_R, Gdk.KEY_r)):
+            self.search_query = None
+            self.history.reset_search()
+
         # Enter
         if event.keyval == Gdk.KEY_Return:
             if self.input_mode:
@@ -531,7 +621,8 @@ class Console (Gtk.ScrolledWindow):
                 start = self.buffer.get_iter_at_offset (self.linestart)
                 self.input = self.buffer.get_text (start, end, True)
                 self.write('\n')
-            else:
+                self.end_input()
+            elif not self.running:
                 self.eval()
             return True
         
@@ -561,6 +652,14 @@ class Console (Gtk.ScrolledWindow):
                 return True
             return False
 
+        # Tab (complete the name before the cursor)
+        elif event.keyval == Gdk.KEY_Tab and not event.get_state() & (
+                Gdk.ModifierType.CONTROL_MASK | Gdk.ModifierType.MOD1_MASK):
+            if self.input_mode or self.running:
+                return False
+            self.complete()
+            return True
+
         # Home
         elif event.keyval == Gdk.KEY_Home:
             start = self.buffer.get_iter_at_offset (self.linestart)
@@ -568,8 +667,15 @@ class Console (Gtk.ScrolledWindow):
             return True
 
         elif event.get_state() & Gdk.ModifierType.CONTROL_MASK:
+            # Ctrl-C (interrupt the running command, copy otherwise)
+            if event.keyval in (Gdk.KEY_C, Gdk.KEY_c):
+                if self.running and not self.buffer.get_has_selection():
+                    self.interrupt()
+                    return True
+                return False
+
             # Ctrl-A
-            if event.keyval in (Gdk.KEY_A, Gdk.KEY_a):
+            elif event.keyval in (Gdk.KEY_A, Gdk.KEY_a):
                 start = self.buffer.get_iter_at_offset (self.linestart)
                 self.text.get_buffer().place_cursor(start)
                 return True
@@ -596,38 +702,266 @@ class Console (Gtk.ScrolledWindow):
                 if not self.input_mode:
                     self.clear()
                 return True
+
+            # Ctrl-R, search the history for what was typed
+            elif event.keyval in (Gdk.KEY_R, Gdk.KEY_r):
+                if not self.input_mode:
+                    if self.search_query is None:
+                        self.search_query = self.current_line()
+                    found = self.history.search (self.search_query)
+                    if found is not None:
+                        self.replace (found)
+                return True
         return False
 
 
 
 # =============================================================================
 class ConsoleWindow:
-    """ Interactive GTK console window """
+    """ Interactive GTK console window
+
+    Each window listens on its own local socket for the code sent from
+    the editor, see on_request.
+    """
+
+    count = 0
+
+    def __init__ (self, ns, title='Python', command=None, threaded=False,
+                  close_handler=None, font=None):
+        """ Initialize s console window
 
-    def __init__ (self, ns, title='Python', command=None):
-        """ Initialize s console window """
+        close_handler is called with the window once it is destroyed, by
+        default closing the window quits the GTK main loop.
+        """
         
+        self.close_handler = close_handler
         self.win = Gtk.Window()
         self.win.set_default_size (640, 400)
         self.win.set_border_width (3)
-        self.win.connect ("destroy", lambda w: Gtk.main_quit())
-        self.win.connect ("delete_event", lambda w, e: Gtk.main_quit())
+        self.win.connect ("destroy", self.on_destroy)
+        self.draw_handler = self.win.connect_after ("draw", self.on_first_draw)
         self.win.set_title (title)
-        self.console = Console (namespace=ns)
+        self.win.connect ("focus-in-event", self.on_focus_in)
+        self.console = Console (namespace=ns, threaded=threaded,
+                                quit_handler=self.close, font=font)
+        ConsoleWindow.count = ConsoleWindow.count + 1
+        self.number = ConsoleWindow.count
+        self.requests = None
         self.win.add (self.console)
         self.console.banner ()
         if command:
-            self.console.execute (command)
+            self.console.execute (command, self.console.prompt1)
         self.win.show_all()
+        startuptrace.mark ('window built')
+        GObject.idle_add (self.listen)
         
         return
 
+    def listen (self):
+        """ Start listening for the code sent from the editor """
+
+        import consoleipc
+        path = consoleipc.console_socket_path (os.getpid(), self.number)
+        try:
+            self.requests = consoleipc.RequestServer (path, self.on_request)
+        except (IOError, OSError):
+            self.requests = None
+        return False
+
+    def on_request (self, request):
+        """ Handler for the requests coming from the editor """
+
+        cmd = request.get ('cmd')
+        if cmd == 'exec':
+            if any_running() and not self.console.running:
+                return {'ok': False,
+                        'error': 'Another console of this process is running'}
+            if not self.console.run_source (request['source'],
+                                            request.get ('filename') or
+                                            '<editor>',
+                                            request.get ('line', 1)):
+                return {'ok': False, 'error': 'The console is busy'}
+            return {'ok': True}
+        return {'ok': False, 'error': 'Unknown command %r' % cmd}
+
+    def on_focus_in (self, widget, event):
+        """ Handler for the window getting the focus, marks its socket as
+        the most recently used one """
+
+        if self.requests is not None:
+            try:
+                os.utime (self.requests.path, None)
+            except OSError:
+                pass
+        return False
+
+    def on_first_draw (self, widget, cr):
+        """ Handler for the first frame of the window """
+
+        startuptrace.mark ('first frame')
+        self.win.disconnect (self.draw_handler)
+        return False
+
+    def close (self, *args):
+        """ Close the window """
+
+        self.win.destroy()
+        return True
+
+    def on_destroy (self, widget):
+        """ Handler for the window destruction """
+
+        if self.requests is not None:
+            self.requests.close()
+            self.requests = None
+        if self.close_handler:
+            self.close_handler (self)
+        else:
+            Gtk.main_quit()
+
+
+# =============================================================================
+class ConsoleServer:
+    """ Long lived console process serving Run Module requests
+
+    It is started once per gedit window and receives requests through a
+    local socket, so interpreter startup and the GTK imports are only paid
+    once. Closing the console windows does not stop the server.
+
+    The windows share the process, so a request arriving while one of
+    them runs something is queued until no console is running.
+    """
+
+    def __init__ (self, path, threaded=False, font=None):
+        """ Initialize the server listening on the socket path """
+
+        import consoleipc
+        self.threaded = threaded
+        self.font = font
+        self.windows = []
+        self.queue = deque()
+        self.queue_source = None
+        self.requests = consoleipc.RequestServer (path, self.on_request)
+
+    def on_request (self, request):
+        """ Handler for the requests coming from gedit """
+
+        cmd = request.get ('cmd')
+        if cmd == 'run':
+            self.font = request.get ('font') or self.font
+            args = (request['filename'], request.get ('namespace') == 'reuse',
+                    request.get ('window') == 'existing',
+                    request.get ('profile', False))
+            if any_running() or self.queue:
+                self.enqueue (args)
+                return {'ok': True, 'pid': os.getpid(), 'queued': True}
+            self.run (*args)
+            return {'ok': True, 'pid': os.getpid()}
+        elif cmd == 'quit':
+            GObject.idle_add (self.quit)
+            return {'ok': True}
+        return {'ok': False, 'error': 'Unknown command %r' % cmd}
+
+    def run (self, filename, reuse_namespace=False, reuse_window=False,
+             profile=False):
+        """ Run filename in a console window
+
+        The last window is reused if asked to and if it is not busy,
+        otherwise a new one is opened. The module runs in a fresh namespace
+        unless reuse_namespace is True.
+        """
+
+        last = None
+        if self.windows:
+            last = self.windows[-1]
+        if reuse_window and last and not last.console.running:
+            window = last
+            if not reuse_namespace:
+                window.console.set_namespace (new_namespace())
+        else:
+            if reuse_namespace and last:
+                ns = last.console.main_module
+            else:
+                ns = new_namespace()
+            window = ConsoleWindow (ns, title = 'Python Console',
+                                    threaded = self.threaded,
+                                    close_handler = self.on_window_closed,
+                                    font = self.font)
+            self.windows.append (window)
+        window.win.present()
+        window.console.open (filename, profile)
+
+    def enqueue (self, args):
+        """ Keep the arguments of run until no console is running """
+
+        self.queue.append (args)
+        if self.queue_source is None:
+            self.queue_source = GObject.timeout_add (QUEUE_INTERVAL,
+                                                     self.on_queue_timeout)
+
+    def on_queue_timeout (self):
+        """ Timer handler, runs the queued requests once the consoles are
+        done, one at a time """
+
+        if any_running():
+            return True
+        self.run (*self.queue.popleft())
+        if self.queue:
+            return True
+        self.queue_source = None
+        return False
+
+    def on_window_closed (self, window):
+        """ Forget about a closed window, the server keeps running """
+
+        if window in self.windows:
+            self.windows.remove (window)
+
+    def quit (self):
+        """ Stop serving and leave the main loop """
+
+        self.requests.close()
+        Gtk.main_quit()
+        return False
+
 
 if __name__ == '__main__':
-    conswin = ConsoleWindow ({'__builtins__': __builtins__,
-                              '__name__': '__main__',
-                              '__doc__': None},
-                              title = 'Python Console')
-    if len(sys.argv) > 1:
-        conswin.console.open (sys.argv[1])
+    parser = optparse.OptionParser (usage='%prog [options] [filename]')
+    parser.add_option ('--threaded', action='store_true',
+                       default=consolesettings.get('threaded_execution'),
+                       help='run commands on a worker thread')
+    parser.add_option ('--no-threaded', action='store_false', dest='threaded',
+                       help='run commands on the GTK main thread')
+    parser.add_option ('--profile', action='store_true', default=False,
+                       help='run the module under the sampling profiler')
+    parser.add_option ('--font',
+                       help='font of the console, gedit\'s editor font by '
+                            'default')
+    parser.add_option ('--exit-at-prompt', action='store_true', default=False,
+                       help='quit at the first prompt after the module, '
+                            'used to time startup')
+    parser.add_option ('--trace-startup', action='store_true', default=False,
+                       help='print the time taken by each startup phase')
+    parser.add_option ('--server', metavar='SOCKET',
+                       help='keep running and serve Run Module requests '
+                            'received on SOCKET')
+    options, args = parser.parse_args()
+
+    if options.server:
+        server = ConsoleServer (options.server, threaded = options.threaded,
+                                font = options.font)
+        if args:
+            server.run (args[0], profile = options.profile)
+        startuptrace.stop()
+    else:
+        conswin = ConsoleWindow (new_namespace(),
+                                 title = 'Python Console',
+                                 threaded = options.threaded,
+                                 font = options.font)
+        if options.exit_at_prompt or options.trace_startup:
+            conswin.console.ready_handler = first_prompt_handler (
+                conswin.console, options.trace_startup,
+                options.exit_at_prompt)
+        if args:
+            conswin.console.open (args[0], options.profile)
     Gtk.main()
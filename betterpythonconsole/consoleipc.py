@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+
+#    This file is part of the Better Python Console Plugin for Gedit
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+"""Local socket messaging between gedit and the console processes.
+
+Requests and replies are single lines of JSON sent over a UNIX socket.
+gedit talks to the consoles with send_request, the console side listens
+with a RequestServer hooked into the GLib main loop.
+"""
+
+import os
+import sys
+import errno
+import json
+import socket
+import tempfile
+
+from gi.repository import GObject
+
+
+def runtime_dir():
+    """Return the private directory holding our sockets, creating it."""
+    base = os.environ.get('XDG_RUNTIME_DIR') or tempfile.gettempdir()
+    path = os.path.join(base, 'betterpythonconsole-%d' % os.getuid())
+    if not os.path.isdir(path):
+        os.makedirs(path, 0o700)
+    return path
+
+
+def socket_path(name):
+    """Return the path of the socket called name."""
+    return os.path.join(runtime_dir(), name + '.sock')
+
+
+def console_socket_path(pid, number):
+    """Return the path of the socket of console window number of the
+    console process pid."""
+    return socket_path('console-%d-%d' % (pid, number))
+
+
+def console_sockets(pids):
+    """Return the sockets of the console windows of the processes pids,
+    the most recently used first (a window touches its socket when it
+    gets the focus)."""
+    prefixes = tuple(['console-%d-' % pid for pid in pids])
+    found = []
+    for name in os.listdir(runtime_dir()):
+        if name.startswith(prefixes) and name.endswith('.sock'):
+            path = os.path.join(runtime_dir(), name)
+            try:
+                found.append((os.stat(path).st_mtime, path))
+            except OSError:
+                pass
+    found.sort(reverse=True)
+    return [path for mtime, path in found]
+
+
+def send_request(path, request, timeout=5.0):
+    """Send request (a dict) to the socket at path and return the reply.
+
+    Raises socket.error or IOError if nobody is listening."""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    data = b''
+    try:
+        sock.connect(path)
+        sock.sendall(json.dumps(request).encode('utf-8') + b'\n')
+        while not data.endswith(b'\n'):
+            chunk = sock.recv(4096)
+            if not chunk:
+                break
+            data += chunk
+    finally:
+        sock.close()
+    if not data:
+        raise IOError(errno.ECONNRESET, 'No reply from %s' % path)
+    return json.loads(data.decode('utf-8'))
+
+
+class RequestServer:
+    """Listen on a UNIX socket and answer requests from the main loop.
+
+    handler is called with each request dict and returns the reply dict.
+    Connections are read without blocking, so a slow client never stalls
+    the console."""
+
+    def __init__(self, path, handler):
+        self.path = path
+        self.handler = handler
+        if os.path.exists(path):
+            os.unlink(path)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(path)
+        self.sock.listen(5)
+        self.sock.setblocking(False)
+        self.watch = GObject.io_add_watch(
+            self.sock.fileno(), GObject.IO_IN, self.on_accept)
+
+    def close(self):
+        """Stop listening and remove the socket file."""
+        if self.sock is None:
+            return
+        GObject.source_remove(self.watch)
+        self.sock.close()
+        self.sock = None
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+    def on_accept(self, fd, condition):
+        """Accept a new connection and wait for its request."""
+        try:
+            conn = self.sock.accept()[0]
+        except socket.error:
+            return True
+        conn.setblocking(False)
+        GObject.io_add_watch(conn.fileno(),
+                             GObject.IO_IN | GObject.IO_HUP | GObject.IO_ERR,
+                             self.on_data, conn, [b''])
+        return True
+
+    def on_data(self, fd, condition, conn, buf):
+        """Collect a request line, dispatch it and send the reply."""
+        try:
+            chunk = conn.recv(65536)
+        except socket.error as e:
+            if e.args[0] in (errno.EAGAIN, errno.EINTR):
+                return True
+            chunk = b''
+        if chunk:
+            buf[0] += chunk
+            if b'\n' not in buf[0]:
+                return True
+        line = buf[0].split(b'\n', 1)[0]
+        if line:
+            try:
+                reply = self.handler(json.loads(line.decode('utf-8')))
+            except Exception:
+                reply = {'ok': False, 'error': str(sys.exc_info()[1])}
+            try:
+                conn.setblocking(True)
+                conn.sendall(json.dumps(reply).encode('utf-8') + b'\n')
+            except socket.error:
+                pass
+        conn.close()
+        return False
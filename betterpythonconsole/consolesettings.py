@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+
+#    This file is part of the Better Python Console Plugin for Gedit
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+"""Settings shared by the plugin and the console windows.
+
+Settings live in gconf next to gedit's own entries, under GCONF_DIR.
+Anything that is not set there falls back to the value in DEFAULTS, so
+the plugin works out of the box without any configuration.
+"""
+
+GCONF_DIR = '/apps/gedit-2/plugins/betterpythonconsole'
+
+DEFAULTS = {
+    # Run commands on a worker thread instead of pumping GTK events
+    # from a trace function.
+    'threaded_execution': False,
+    # Scrollback limits of the console buffer, 0 means unlimited.
+    'scrollback_lines': 10000,
+    'scrollback_bytes': 0,
+    # File receiving the text trimmed from the scrollback, '%p' is
+    # replaced by the process id. Empty means trimmed text is dropped.
+    'scrollback_spill': '',
+    # Reuse one long lived console process per gedit window for F5.
+    'console_server': False,
+    # With console_server: 'fresh' or 'reuse' the namespace of the last
+    # run, and 'new' or 'existing' window for each run.
+    'server_namespace': 'fresh',
+    'server_window': 'new',
+    # Fork each console from a template process which has already
+    # imported preload_modules (a comma separated list).
+    'zygote': False,
+    'preload_modules': '',
+    # Characters kept in the bottom panel showing what the console
+    # processes write to their real stdout and stderr.
+    'output_log_bytes': 262144,
+    # Split modules at '# %%' markers and only run the cells from the
+    # first one changed since the last run in the same console.
+    'cell_mode': False,
+    # Command history shared by the consoles, '' means the default file
+    # and a size of 0 keeps the history in memory only.
+    'history_file': '',
+    'history_size': 100000,
+    # Sampling interval of Profile Module, and the directory the
+    # collapsed stack files go to ('' means the default cache dir).
+    'profile_interval_ms': 5,
+    'profile_dir': '',
+    # Show wall/CPU time and peak RSS growth after each command, and
+    # the top allocations when tracemalloc is available.
+    'instrument': False,
+    'trace_allocations': False,
+    # Items, or characters of a string, shown at once of an expression
+    # result, the rest is shown a page at a time when clicked.
+    'result_items': 100,
+    'result_chars': 4000,
+    # Before each command or run, reload the modules imported from
+    # outside the Python installation whose source has changed.
+    'autoreload': False,
+    # Limits of each command or run, 0 means none: wall and CPU
+    # seconds, and megabytes of address space it may add.
+    'limit_wall_seconds': 0,
+    'limit_cpu_seconds': 0,
+    'limit_memory_mb': 0,
+    # Consoles whose CPU time has not moved for console_idle_seconds are
+    # idle. When the consoles of a window use more than
+    # console_memory_cap_mb (0 means no cap), the largest idle one is
+    # closed.
+    'console_idle_seconds': 300,
+    'console_memory_cap_mb': 0,
+    # Highlight the Python syntax of the input and of traceback frames.
+    'syntax_highlighting': True,
+    # Run a persistent asyncio loop from the console main loop once a
+    # command imports asyncio, and allow top level await (Python 3.8+).
+    'asyncio': True,
+    # Interpreter running the consoles, it needs the GTK 3 bindings.
+    'interpreter': 'python2',
+}
+
+_client = None
+
+
+def _get_client():
+    """Return the default gconf client, or None if gconf is unavailable."""
+    global _client
+    if _client is None:
+        try:
+            from gi.repository import GConf
+            _client = GConf.Client.get_default()
+        except Exception:
+            _client = False
+        else:
+            # Fetch all the settings in one round trip to gconfd, get()
+            # is then answered from the client cache
+            try:
+                _client.add_dir(GCONF_DIR,
+                                GConf.ClientPreloadType.PRELOAD_ONELEVEL)
+            except Exception:
+                pass
+    return _client or None
+
+
+def get(name):
+    """Return the value of the setting name, or its default."""
+    default = DEFAULTS[name]
+    client = _get_client()
+    if client is None:
+        return default
+    try:
+        value = client.get(GCONF_DIR + '/' + name)
+    except Exception:
+        return default
+    if value is None:
+        return default
+    if isinstance(default, bool):
+        return value.get_bool()
+    if isinstance(default, int):
+        return value.get_int()
+    if isinstance(default, float):
+        return value.get_float()
+    return value.get_string()
+
+
+def editor_font():
+    """Return the font of the gedit editor, as a Pango font name."""
+    client = _get_client()
+    if client is None:
+        return 'Monospace 10'
+    try:
+        if client.get_bool(
+                '/apps/gedit-2/preferences/editor/font/use_default_font'):
+            font = client.get_string('/desktop/gnome/interface/font_name')
+        else:
+            font = client.get_string(
+                '/apps/gedit-2/preferences/editor/font/editor_font')
+    except Exception:
+        font = None
+    return font or 'Monospace 10'
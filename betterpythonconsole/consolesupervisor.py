@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+
+#    This file is part of the Better Python Console Plugin for Gedit
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+"""Tracking of the console processes started from a gedit window.
+
+Each console child is reaped from the main loop by a GLib child watch as
+soon as it exits, so closed consoles do not linger as zombies. Every few
+seconds the RSS and CPU time of the consoles are read from /proc and shown
+in the Consoles panel. A console whose CPU time has not moved for a while
+counts as idle; idle consoles can be closed from the panel, and when the
+consoles of the window use more memory than the cap, the largest idle one
+is closed.
+"""
+
+import os
+import time
+import signal
+from collections import OrderedDict
+
+from gi.repository import Gtk
+from gi.repository import GLib
+from gi.repository import GObject
+
+# Seconds between two readings of the consoles' resource use
+SAMPLE_INTERVAL = 2
+
+# CPU seconds per reading under which a console counts as doing nothing
+IDLE_CPU = 0.02
+
+MB = 1024 * 1024
+
+_page_size = os.sysconf('SC_PAGE_SIZE')
+_clock_ticks = os.sysconf('SC_CLK_TCK')
+
+
+def proc_usage(pid):
+    """Return the CPU seconds and RSS bytes of process pid, or None when it
+    is gone (or a zombie)."""
+    try:
+        f = open('/proc/%d/stat' % pid)
+        try:
+            stat = f.read()
+        finally:
+            f.close()
+    except (IOError, OSError):
+        return None
+    # Fields after the command, which may contain spaces
+    fields = stat.rsplit(')', 1)[1].split()
+    if fields[0] == 'Z':
+        return None
+    cpu = float(int(fields[11]) + int(fields[12])) / _clock_ticks
+    return cpu, int(fields[21]) * _page_size
+
+
+def proc_children(pid):
+    """Return the pids of the children of process pid, when the kernel
+    tells them."""
+    try:
+        f = open('/proc/%d/task/%d/children' % (pid, pid))
+        try:
+            return [int(child) for child in f.read().split()]
+        finally:
+            f.close()
+    except (IOError, OSError, ValueError):
+        return []
+
+
+class ConsoleEntry:
+    """A console process and its latest resource use."""
+
+    def __init__(self, pid, label, process=None, forks=False):
+        self.pid = pid
+        self.label = label
+        self.process = process
+        # The children of a console template are consoles too
+        self.forks = forks
+        self.cpu = 0.0
+        self.rss = 0
+        self.active = time.time()
+        self.watch = None
+
+    def idle_for(self, now):
+        """Return the seconds since the console last used the CPU."""
+        return now - self.active
+
+
+class ConsoleSupervisor(Gtk.Box):
+    """Bottom panel listing the console processes of a window, with their
+    memory, CPU time and idle time."""
+
+    def __init__(self, memory_cap_mb, idle_seconds, notify):
+        Gtk.Box.__init__(self, orientation=Gtk.Orientation.VERTICAL,
+                         spacing=4)
+        self.memory_cap = memory_cap_mb * MB
+        self.idle_seconds = idle_seconds
+        self.notify = notify
+        self.entries = OrderedDict()
+
+        # pid, name, RSS, CPU, idle
+        self.store = Gtk.ListStore(int, str, str, str, str)
+        self.view = Gtk.TreeView(model=self.store)
+        for i, title in enumerate([_("PID"), _("Console"), _("Memory"),
+                                   _("CPU"), _("Idle")]):
+            column = Gtk.TreeViewColumn(title, Gtk.CellRendererText(), text=i)
+            column.set_resizable(True)
+            self.view.append_column(column)
+        scrolled = Gtk.ScrolledWindow()
+        scrolled.set_policy(Gtk.PolicyType.AUTOMATIC,
+                            Gtk.PolicyType.AUTOMATIC)
+        scrolled.add(self.view)
+        self.pack_start(scrolled, True, True, 0)
+
+        buttons = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=4)
+        self.total = Gtk.Label()
+        buttons.pack_start(self.total, False, False, 4)
+        close_idle = Gtk.Button(label=_("Close Idle Consoles"))
+        close_idle.connect('clicked', lambda button: self.close_idle())
+        buttons.pack_end(close_idle, False, False, 0)
+        close = Gtk.Button(label=_("Close Console"))
+        close.connect('clicked', lambda button: self.close_selected())
+        buttons.pack_end(close, False, False, 0)
+        self.pack_start(buttons, False, False, 0)
+        self.show_all()
+
+        self.timer = GObject.timeout_add_seconds(SAMPLE_INTERVAL,
+                                                 self.on_sample)
+
+    def stop(self):
+        """Stop watching, the consoles keep running."""
+        GObject.source_remove(self.timer)
+        for entry in self.entries.values():
+            if entry.watch is not None:
+                GObject.source_remove(entry.watch)
+        self.entries.clear()
+
+    def track(self, process, label, forks=False):
+        """Track a child process started with subprocess, it is reaped by a
+        child watch when it exits."""
+        entry = ConsoleEntry(process.pid, label, process, forks)
+        entry.watch = GLib.child_watch_add(GLib.PRIORITY_DEFAULT, process.pid,
+                                           self.on_child_exit, entry)
+        self.entries[entry.pid] = entry
+        self.refresh()
+
+    def adopt(self, pid, label):
+        """Track a console which is not our child, e.g. forked from the
+        template. Its parent reaps it, it is dropped once gone."""
+        if pid not in self.entries:
+            self.entries[pid] = ConsoleEntry(pid, label)
+            self.refresh()
+
+    def alive(self, process):
+        """Tell whether a tracked child is still running. Children are only
+        waited for by their child watch, use this rather than poll()."""
+        return process is not None and process.returncode is None
+
+    def console_pids(self):
+        """Return the pids of the consoles, the newest first."""
+        return [pid for pid, entry in reversed(list(self.entries.items()))
+                if not entry.forks]
+
+    def selected_pid(self):
+        """Return the pid of the console selected in the list, or None."""
+        model, row = self.view.get_selection().get_selected()
+        if row is None:
+            return None
+        return model[row][0]
+
+    def on_child_exit(self, pid, status, entry):
+        """Child watch handler, the child has been reaped."""
+        if os.WIFSIGNALED(status):
+            entry.process.returncode = -os.WTERMSIG(status)
+        else:
+            entry.process.returncode = os.WEXITSTATUS(status)
+        entry.watch = None
+        self.entries.pop(pid, None)
+        self.refresh()
+
+    def on_sample(self):
+        """Timer handler, reads the resource use of the consoles."""
+        now = time.time()
+        for entry in list(self.entries.values()):
+            if entry.forks:
+                for pid in proc_children(entry.pid):
+                    self.adopt(pid, _("forked console"))
+        for pid, entry in list(self.entries.items()):
+            usage = proc_usage(pid)
+            if usage is None:
+                if entry.process is None:
+                    del self.entries[pid]
+                continue
+            cpu, entry.rss = usage
+            if cpu - entry.cpu > IDLE_CPU:
+                entry.active = now
+            entry.cpu = cpu
+        if self.memory_cap and self.total_rss() > self.memory_cap:
+            self.enforce_cap(now)
+        self.refresh()
+        return True
+
+    def total_rss(self):
+        """Return the memory used by all the consoles."""
+        return sum([entry.rss for entry in self.entries.values()])
+
+    def idle_entries(self, now):
+        """Return the idle consoles, largest first."""
+        idle = [entry for entry in self.entries.values()
+                if not entry.forks
+                and entry.idle_for(now) >= self.idle_seconds]
+        idle.sort(key=lambda entry: -entry.rss)
+        return idle
+
+    def enforce_cap(self, now):
+        """Close the largest idle console, the memory cap is exceeded."""
+        idle = self.idle_entries(now)
+        if not idle:
+            return
+        entry = idle[0]
+        self.close(entry)
+        self.notify(_("Closed idle console %s (%d MB), consoles were over "
+                      "%d MB") % (entry.label, entry.rss // MB,
+                                  self.memory_cap // MB))
+
+    def close(self, entry):
+        """Ask a console to quit."""
+        try:
+            os.kill(entry.pid, signal.SIGTERM)
+        except OSError:
+            pass
+        # A child stays listed until its watch has reaped it
+        if entry.process is None:
+            self.entries.pop(entry.pid, None)
+
+    def close_idle(self):
+        """Close all the idle consoles."""
+        idle = self.idle_entries(time.time())
+        for entry in idle:
+            self.close(entry)
+        self.notify(_("Closed %d idle consoles") % len(idle))
+        self.refresh()
+
+    def close_selected(self):
+        """Close the console selected in the list."""
+        entry = self.entries.get(self.selected_pid())
+        if entry is not None:
+            self.close(entry)
+            self.refresh()
+
+    def refresh(self):
+        """Show the entries in the list."""
+        now = time.time()
+        selection = self.view.get_selection()
+        model, row = selection.get_selected()
+        selected = row is not None and model[row][0] or None
+        self.store.clear()
+        for entry in self.entries.values():
+            idle = entry.idle_for(now)
+            row = self.store.append([
+                entry.pid, entry.label, '%.1f MB' % (float(entry.rss) / MB),
+                '%.1f s' % entry.cpu,
+                idle >= SAMPLE_INTERVAL * 2 and '%d s' % idle or ''])
+            if entry.pid == selected:
+                selection.select_iter(row)
+        text = _("%d consoles, %.1f MB") % (len(self.entries),
+                                            float(self.total_rss()) / MB)
+        if self.memory_cap:
+            text = text + _(" of %d MB") % (self.memory_cap // MB)
+        self.total.set_text(text)
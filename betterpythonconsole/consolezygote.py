@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+
+#    This file is part of the Better Python Console Plugin for Gedit
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+"""Template process forking ready made consoles.
+
+The template imports the modules listed with --preload once, then waits
+for Run Module requests on a UNIX socket and fork()s a child console for
+each of them. Every console is still a separate process, but none of
+them pays for the preloaded imports again.
+
+Gtk and Gdk initialise the display connection when they are imported,
+and a connection cannot be shared between processes, so they are only
+imported by the children, after the fork.
+"""
+
+import os
+import sys
+import json
+import signal
+import socket
+import optparse
+import traceback
+
+# Shared with every console, whatever the preload list
+from gi.repository import GObject, GLib, Pango
+
+import consolesettings
+import consolecore
+
+
+def preload(modules):
+    """Import the given modules, reporting the ones that fail."""
+    for name in modules:
+        try:
+            __import__(name)
+        except Exception:
+            sys.stderr.write('Unable to preload %s:\n' % name)
+            traceback.print_exc()
+
+
+def run_console(filename, profile=False, font=None):
+    """Body of a forked child: show a console running filename."""
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    if 'random' in sys.modules:
+        sys.modules['random'].seed()
+    import consoleinterface
+    from gi.repository import Gtk
+    conswin = consoleinterface.ConsoleWindow(
+        consoleinterface.new_namespace(), title='Python Console',
+        threaded=consolesettings.get('threaded_execution'), font=font)
+    conswin.console.open(filename, profile)
+    Gtk.main()
+
+
+class Zygote:
+    """Serve Run Module requests by forking the template process."""
+
+    def __init__(self, path):
+        self.path = path
+        if os.path.exists(path):
+            os.unlink(path)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(path)
+        self.sock.listen(5)
+        # Connection of the request being answered
+        self.conn = None
+        # Children are reaped by the kernel, the template never waits
+        signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+
+    def fork(self, filename, profile=False, font=None):
+        """Fork a child console for filename and return its pid."""
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            status = 0
+            try:
+                # The parent answers the request, the child keeps neither
+                # socket, so the editor sees the end of the reply
+                self.sock.close()
+                if self.conn is not None:
+                    self.conn.close()
+                    self.conn = None
+                run_console(filename, profile, font)
+            except Exception:
+                traceback.print_exc()
+                status = 1
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(status)
+        return pid
+
+    def handle(self, request):
+        """Answer a request, None means stop serving."""
+        cmd = request.get('cmd')
+        if cmd == 'run':
+            return {'ok': True, 'pid': self.fork(request['filename'],
+                                                 request.get('profile'),
+                                                 request.get('font'))}
+        elif cmd == 'quit':
+            return None
+        return {'ok': False, 'error': 'Unknown command %r' % cmd}
+
+    def serve(self):
+        """Answer requests until asked to quit."""
+        while True:
+            conn = self.conn = self.sock.accept()[0]
+            try:
+                data = b''
+                while b'\n' not in data:
+                    chunk = conn.recv(65536)
+                    if not chunk:
+                        break
+                    data += chunk
+                line = data.split(b'\n', 1)[0]
+                if not line:
+                    continue
+                try:
+                    reply = self.handle(json.loads(line.decode('utf-8')))
+                except Exception:
+                    reply = {'ok': False, 'error': str(sys.exc_info()[1])}
+                if reply is None:
+                    conn.sendall(b'{"ok": true}\n')
+                    break
+                conn.sendall(json.dumps(reply).encode('utf-8') + b'\n')
+            except socket.error:
+                pass
+            finally:
+                self.conn = None
+                conn.close()
+        self.sock.close()
+        os.unlink(self.path)
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser(usage='%prog [options] SOCKET [filename]')
+    parser.add_option('--preload', default='',
+                      help='comma separated list of modules to import once')
+    parser.add_option('--profile', action='store_true', default=False,
+                      help='profile the first module')
+    parser.add_option('--font', help='font of the consoles')
+    options, args = parser.parse_args()
+    if not args:
+        parser.error('the socket path is required')
+
+    preload([name.strip() for name in options.preload.split(',')
+             if name.strip()])
+    zygote = Zygote(args[0])
+    if len(args) > 1:
+        zygote.fork(args[1], options.profile, options.font)
+    zygote.serve()
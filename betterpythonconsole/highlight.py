@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+
+#    This file is part of the Better Python Console Plugin for Gedit
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+"""Python syntax highlighting, one line at a time.
+
+A line is split into spans of keywords, builtins, strings, comments and
+the like with a single regular expression. The only state carried from
+one line to the next is the triple quote of a string left open, so a
+front end only has to highlight the lines which changed, and the
+following ones while that state changes.
+
+Traceback frame lines ('  File "x", line 3, in f') are recognized too, to
+highlight the file names and the source lines shown in tracebacks.
+"""
+
+import re
+import keyword
+
+try:
+    import builtins
+except ImportError:
+    import __builtin__ as builtins
+
+KEYWORDS = frozenset(keyword.kwlist)
+BUILTINS = frozenset([name for name in dir(builtins)
+                      if not name.startswith('_')]) - KEYWORDS
+
+# Colours of each kind of span, those of IDLE
+COLOURS = {
+    'keyword': '#ff7700',
+    'builtin': '#900090',
+    'string': '#00aa00',
+    'comment': '#dd0000',
+    'definition': '#0000ff',
+    'decorator': '#0000ff',
+    'filename': '#0000ff',
+}
+
+TOKEN_RE = re.compile(r'''
+    (?P<comment>\#.*)
+  | (?P<string>[rRbBuUfF]{0,2}
+        (?:\'\'\'|"""|'(?:\\.|[^'\\])*'?|"(?:\\.|[^"\\])*"?))
+  | (?P<decorator>^\s*@[\w.]+)
+  | (?P<name>[A-Za-z_]\w*)
+''', re.VERBOSE)
+
+# The end of a triple quoted string
+CLOSE_RES = dict([(quote, re.compile(r'(?:\\.|[^\\])*?' + quote))
+                  for quote in ("'''", '"""')])
+
+FRAME_RE = re.compile(r'^  File "(?P<filename>[^"]*)", line \d+')
+
+
+def highlight(line, state=None):
+    """Return the spans (start, end, kind) of line, and the triple quote
+    left open at its end, state being the one open at its start."""
+    spans = []
+    pos = 0
+    if state:
+        match = CLOSE_RES[state].match(line)
+        if match is None:
+            return [(0, len(line), 'string')], state
+        pos = match.end()
+        spans.append((0, pos, 'string'))
+    previous = None
+    while True:
+        match = TOKEN_RE.search(line, pos)
+        if match is None:
+            return spans, None
+        kind = match.lastgroup
+        start, end = match.span()
+        if kind == 'string':
+            quote = match.group().lstrip('rRbBuUfF')[:3]
+            if quote in CLOSE_RES:
+                close = CLOSE_RES[quote].match(line, end)
+                if close is None:
+                    spans.append((start, len(line), 'string'))
+                    return spans, quote
+                end = close.end()
+            spans.append((start, end, 'string'))
+        elif kind == 'name':
+            word = match.group()
+            if previous in ('def', 'class'):
+                spans.append((start, end, 'definition'))
+            elif word in KEYWORDS:
+                spans.append((start, end, 'keyword'))
+            elif word in BUILTINS and line[start - 1:start] != '.':
+                spans.append((start, end, 'builtin'))
+            previous = word
+        else:
+            spans.append((start, end, kind))
+        pos = end
+
+
+def open_quote(lines, state=None):
+    """Return the triple quote left open after lines."""
+    for line in lines:
+        if state or "'''" in line or '"""' in line:
+            state = highlight(line, state)[1]
+    return state
+
+
+def traceback_spans(lines):
+    """Return the spans (line, start, end, kind) of the frames in lines
+    of a traceback: the file names and the source lines below them."""
+    spans = []
+    for number, line in enumerate(lines):
+        match = FRAME_RE.match(line)
+        if match is None:
+            continue
+        spans.append((number, match.start('filename'),
+                      match.end('filename'), 'filename'))
+        if number + 1 < len(lines) and lines[number + 1].startswith('    '):
+            source = lines[number + 1]
+            for start, end, kind in highlight(source)[0]:
+                spans.append((number + 1, start, end, kind))
+    return spans
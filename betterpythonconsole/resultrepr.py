@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+
+#    This file is part of the Better Python Console Plugin for Gedit
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+"""Bounded display of expression results.
+
+The interactive interpreter prints the full repr of a result, which for a
+list of a million items means building a huge string and pushing all of
+it to the console. Here results are shown with reprlib style limits on
+the size and depth of what is shown, and the items of a large list,
+tuple, dict, set or string are shown one page at a time: the rest is left
+in an Expansion, which renders the next page only when asked to.
+"""
+
+import sys
+from itertools import islice
+
+try:
+    import reprlib
+except ImportError:
+    import repr as reprlib
+
+PY3 = sys.version_info[0] >= 3
+
+if PY3:
+    STRING_TYPES = (str, bytes)
+else:
+    STRING_TYPES = (str, unicode)
+
+# Items shown of a container nested in a result, and nesting levels
+NESTED_ITEMS = 10
+NESTED_LEVELS = 4
+
+
+class BoundedRepr(reprlib.Repr):
+    """repr with limits on the number of items, length and depth."""
+
+    def __init__(self, chars):
+        reprlib.Repr.__init__(self)
+        self.maxlevel = NESTED_LEVELS
+        for name in ('maxtuple', 'maxlist', 'maxarray', 'maxdict', 'maxset',
+                     'maxfrozenset', 'maxdeque'):
+            setattr(self, name, NESTED_ITEMS)
+        self.maxstring = self.maxother = self.maxlong = chars
+
+
+def string_quote(value):
+    """Return the quote repr uses for the whole of a string."""
+    if PY3 and isinstance(value, bytes):
+        single, double = b"'", b'"'
+    else:
+        single, double = "'", '"'
+    if single in value and double not in value:
+        return '"'
+    return "'"
+
+
+def string_chunk(chunk, quote):
+    """Return the repr of part of a string, without its quotes and as if
+    it was quoted with quote. Returns the prefix (e.g. b) too."""
+    text = repr(chunk)
+    first = text.index(text[-1])
+    prefix, inner = text[:first], text[first + 1:-1]
+    if text[-1] != quote and quote == "'":
+        inner = inner.replace("'", "\\'")
+    return prefix, inner
+
+
+class Expansion:
+    """The part of a result which is not shown yet."""
+
+    def __init__(self, formatter, value, start, iterator=None, quote=None):
+        self.formatter = formatter
+        self.value = value
+        self.start = start
+        self.iterator = iterator
+        self.quote = quote
+
+    def remaining(self):
+        """Return the number of items or characters left."""
+        return len(self.value) - self.start
+
+    def label(self):
+        """Return the text standing for the rest of the result."""
+        if isinstance(self.value, STRING_TYPES):
+            return '...(%d more characters)' % self.remaining()
+        return ', ...(%d more items)' % self.remaining()
+
+    def render(self):
+        """Return the text of the next page and the Expansion of what is
+        left after it, or None."""
+        try:
+            return self.formatter.page(self)
+        except Exception:
+            return (' <%s while expanding>' % sys.exc_info()[0].__name__,
+                    None)
+
+
+class ResultFormatter:
+    """Format results with at most items items or chars characters at
+    first, leaving the rest of large values to an Expansion."""
+
+    def __init__(self, items=100, chars=4000):
+        self.items = items
+        self.chars = chars
+        self.repr = BoundedRepr(chars)
+
+    def item_repr(self, item):
+        """Return the bounded repr of an item of a result."""
+        return self.repr.repr1(item, NESTED_LEVELS - 1)
+
+    def brackets(self, value):
+        """Return the opening and closing text of a container."""
+        if isinstance(value, list):
+            return '[', ']'
+        elif isinstance(value, tuple):
+            return '(', ')'
+        elif isinstance(value, dict):
+            return '{', '}'
+        name = type(value).__name__
+        if PY3:
+            if name == 'set':
+                return '{', '}'
+            return name + '({', '})'
+        return name + '([', '])'
+
+    def format(self, value):
+        """Return the head of the text of value, the Expansion of the rest
+        (or None) and the tail of the text."""
+        kind = type(value)
+        if kind in STRING_TYPES and len(value) > self.chars:
+            quote = string_quote(value)
+            prefix, inner = string_chunk(value[:self.chars], quote)
+            return (prefix + quote + inner,
+                    Expansion(self, value, self.chars, quote=quote), quote)
+        if (kind in (list, tuple, dict, set, frozenset)
+                and len(value) > self.items):
+            opening, closing = self.brackets(value)
+            iterator = None
+            if kind in (dict, set, frozenset):
+                iterator = iter(value.items() if kind is dict else value)
+            expansion = Expansion(self, value, 0, iterator)
+            text, rest = self.page(expansion)
+            return opening + text[2:], rest, closing
+        return self.repr.repr(value), None, ''
+
+    def page(self, expansion):
+        """Return the text of the page starting at expansion, with its
+        leading separator, and the Expansion of the rest or None."""
+        value = expansion.value
+        start = expansion.start
+        if isinstance(value, STRING_TYPES):
+            end = start + self.chars
+            prefix, text = string_chunk(value[start:end], expansion.quote)
+        else:
+            end = start + self.items
+            if expansion.iterator is None:
+                reprs = [self.item_repr(item) for item in value[start:end]]
+            elif isinstance(value, dict):
+                reprs = ['%s: %s' % (self.item_repr(key),
+                                     self.item_repr(item))
+                         for key, item in islice(expansion.iterator,
+                                                 end - start)]
+            else:
+                reprs = [self.item_repr(item)
+                         for item in islice(expansion.iterator, end - start)]
+            text = ', ' + ', '.join(reprs)
+            end = start + len(reprs)
+        if end >= len(value) or end == start:
+            return text, None
+        return text, Expansion(self, value, end, expansion.iterator,
+                               expansion.quote)
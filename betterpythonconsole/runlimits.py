@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+
+#    This file is part of the Better Python Console Plugin for Gedit
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+"""Limits on the wall time, CPU time and memory of a console run.
+
+A run on the main thread is stopped by interval timers: SIGALRM for the
+wall time and SIGPROF for the CPU time, whose handlers raise the limit
+exception. A signal also interrupts a blocking system call (a sleep, a
+socket read, a wait for a process), so those are stopped too. A run on a
+worker thread is watched by a watchdog thread, which raises the
+exception in the worker; it only shows once a blocking call returns.
+
+Code stuck in a single C call never gives the exception a chance to be
+raised, so the CPU time also gets an RLIMIT_CPU a few seconds past the
+limit, where the kernel ends the console process. The address space is
+limited with RLIMIT_AS, so allocations past it fail with a MemoryError.
+"""
+
+import os
+import sys
+import time
+import signal
+import threading
+
+try:
+    from _thread import interrupt_main
+except ImportError:
+    from thread import interrupt_main
+
+try:
+    import ctypes
+except ImportError:
+    ctypes = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Seconds between two checks of the watchdog
+WATCH_INTERVAL = 0.05
+
+# Seconds of CPU time past the limit before the process is ended
+CPU_GRACE = 5
+
+# Seconds the watchdog waits for a stop to be noticed on the main thread
+# before interrupting it, e.g. in a loop without line events
+ESCALATE_DELAY = 1.0
+
+MB = 1024 * 1024
+
+
+class LimitExceeded(KeyboardInterrupt):
+    """A run went past one of its limits."""
+    limit = ''
+
+
+class WallTimeLimitExceeded(LimitExceeded):
+    """A run went past its wall time limit."""
+    limit = 'wall time'
+
+
+class CpuTimeLimitExceeded(LimitExceeded):
+    """A run went past its CPU time limit."""
+    limit = 'CPU time'
+
+
+def async_raise(thread_id, exc):
+    """Raise the exception class exc in another thread when it runs its
+    next bytecode, or cancel a pending one if exc is None. Returns False
+    when this Python can not do it."""
+    if ctypes is None or not hasattr(ctypes, 'pythonapi'):
+        return False
+    if sys.version_info[:2] >= (3, 7):
+        ident = ctypes.c_ulong(thread_id)
+    else:
+        ident = ctypes.c_long(thread_id)
+    if exc is not None:
+        exc = ctypes.py_object(exc)
+    found = ctypes.pythonapi.PyThreadState_SetAsyncExc(ident, exc)
+    if found > 1:
+        ctypes.pythonapi.PyThreadState_SetAsyncExc(ident, None)
+        return False
+    return found == 1
+
+
+def cpu_time():
+    """Return the CPU time used by the process so far."""
+    times = os.times()
+    return times[0] + times[1]
+
+
+def address_space():
+    """Return the address space size of the process, or None."""
+    try:
+        f = open('/proc/self/statm')
+        try:
+            pages = int(f.read().split()[0])
+        finally:
+            f.close()
+    except (IOError, OSError, ValueError, IndexError):
+        return None
+    return pages * os.sysconf('SC_PAGE_SIZE')
+
+
+class RunLimits:
+    """Limits applied to each run: wall and CPU seconds, and megabytes of
+    address space a run may add. 0 means no limit."""
+
+    def __init__(self, wall=0, cpu=0, memory=0):
+        self.wall = wall
+        self.cpu = cpu
+        self.memory = memory
+        self.done = None
+        self.saved = []
+        # (signal, timer, previous handler) of the armed timers
+        self.timers = []
+        # The exception of the limit hit, when the run was interrupted
+        self.tripped = None
+
+    def active(self):
+        """Tell whether any limit is set."""
+        return bool(self.wall or self.cpu or self.memory)
+
+    def start(self, stop, main_thread=False):
+        """Apply the limits to the run starting now. stop is called, from
+        the watchdog thread or a signal handler, with the exception ending
+        the run. main_thread tells that the run is on the main thread."""
+        self.tripped = None
+        if not self.active():
+            return
+        self.saved = []
+        if self.cpu:
+            self.set_rlimit('RLIMIT_CPU',
+                            int(cpu_time() + self.cpu + CPU_GRACE) + 1)
+        if self.memory:
+            size = address_space()
+            if size is not None:
+                self.set_rlimit('RLIMIT_AS', size + int(self.memory * MB))
+        if main_thread and self.arm_timers(stop):
+            return
+        if self.wall or self.cpu:
+            self.done = threading.Event()
+            watchdog = threading.Thread(target=self.watch,
+                                        args=(self.done, stop, main_thread))
+            watchdog.daemon = True
+            watchdog.start()
+
+    def arm_timers(self, stop):
+        """Arm the interval timers of a run on the main thread, return
+        False where they are missing."""
+        if not hasattr(signal, 'setitimer'):
+            return False
+        timers = []
+        if self.wall:
+            timers.append((signal.SIGALRM, signal.ITIMER_REAL, self.wall,
+                           WallTimeLimitExceeded))
+        if self.cpu:
+            timers.append((signal.SIGPROF, signal.ITIMER_PROF, self.cpu,
+                           CpuTimeLimitExceeded))
+        try:
+            for signum, which, seconds, exc in timers:
+                previous = signal.signal(signum, self.handler(stop, exc))
+                self.timers.append((signum, which, previous))
+                # Fires again every WATCH_INTERVAL, in case the exception
+                # is swallowed, e.g. by a GTK callback it interrupted
+                signal.setitimer(which, seconds, WATCH_INTERVAL)
+        except ValueError:
+            # Not the main thread of the interpreter after all
+            self.stop_timers()
+            return False
+        return True
+
+    def handler(self, stop, exc):
+        """Return the signal handler ending the run with exc."""
+        def on_signal(signum, frame):
+            if not self.timers:
+                return
+            self.tripped = exc
+            stop(exc)
+            raise exc
+        return on_signal
+
+    def stop_timers(self):
+        """Disarm the timers, as soon as the code of the run returns so
+        they never fire in the console code reporting its outcome."""
+        timers, self.timers = self.timers, []
+        for signum, which, previous in reversed(timers):
+            signal.setitimer(which, 0)
+            signal.signal(signum, previous)
+
+    def finish(self):
+        """Lift the limits once the run is over."""
+        self.stop_timers()
+        if self.done is not None:
+            self.done.set()
+            self.done = None
+        for name, limits in reversed(self.saved):
+            try:
+                resource.setrlimit(getattr(resource, name), limits)
+            except (ValueError, OSError):
+                pass
+        self.saved = []
+
+    def set_rlimit(self, name, soft):
+        """Lower the soft limit name to soft, keeping the previous limits
+        to restore them in finish."""
+        if resource is None or not hasattr(resource, name):
+            return
+        which = getattr(resource, name)
+        previous = resource.getrlimit(which)
+        hard = previous[1]
+        if hard != resource.RLIM_INFINITY:
+            soft = min(soft, hard)
+        try:
+            resource.setrlimit(which, (soft, hard))
+        except (ValueError, OSError):
+            return
+        self.saved.append((name, previous))
+
+    def watch(self, done, stop, main_thread):
+        """Body of the watchdog thread of a run."""
+        deadline = self.wall and time.time() + self.wall
+        budget = self.cpu and cpu_time() + self.cpu
+        while not done.wait(WATCH_INTERVAL):
+            if deadline and time.time() > deadline:
+                self.trip(done, stop, WallTimeLimitExceeded, main_thread)
+                return
+            if budget and cpu_time() > budget:
+                self.trip(done, stop, CpuTimeLimitExceeded, main_thread)
+                return
+
+    def trip(self, done, stop, exc, main_thread):
+        """Stop the run with exc. A run on the main thread only notices
+        the stop on its next line event, which a loop on a single line
+        never has: if it does not end soon, interrupt it as Ctrl-C in a
+        terminal would."""
+        self.tripped = exc
+        stop(exc)
+        if main_thread and not done.wait(ESCALATE_DELAY):
+            interrupt_main()
+
+    def describe(self, exc_type):
+        """Return which limit ended a run with exc_type, or None."""
+        if exc_type is None:
+            return None
+        if exc_type is KeyboardInterrupt and self.tripped is not None:
+            # Interrupted by the watchdog on behalf of the limit
+            exc_type = self.tripped
+        if issubclass(exc_type, WallTimeLimitExceeded):
+            return 'wall time limit of %g s reached' % self.wall
+        if issubclass(exc_type, CpuTimeLimitExceeded):
+            return 'CPU time limit of %g s reached' % self.cpu
+        if issubclass(exc_type, MemoryError) and self.memory:
+            return 'address space limit of %g MB reached' % self.memory
+        return None
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+
+#    This file is part of the Better Python Console Plugin for Gedit
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+"""Low overhead sampling profiler used by Profile Module.
+
+Instead of tracing every call, the stack of the profiled thread is looked
+at every few milliseconds, from a timer thread through
+sys._current_frames(). Profile Module runs the profiled code on a worker
+thread, so its main loop keeps running, and the samples are taken on wall
+clock time: time spent sleeping or waiting for I/O shows in the profile.
+The samples give a hot function report and can be saved as collapsed
+stacks, the input format of flamegraph tools.
+"""
+
+import os
+import sys
+import time
+import threading
+
+
+def frame_name(key):
+    """Return a readable name for a (filename, first line, name) key."""
+    filename, line, name = key
+    return '%s (%s:%d)' % (name, os.path.basename(filename), line)
+
+
+def default_profile_dir():
+    """Return the directory the collapsed stack files are saved in."""
+    base = os.environ.get('XDG_CACHE_HOME') or \
+        os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'betterpythonconsole', 'profiles')
+
+
+class SamplingProfiler:
+    """Sample the stack of one thread at a fixed interval.
+
+    Frames at and below a frame running one of the stop_codes (the code
+    running the profiled command) are left out of the samples, and so are
+    frames running one of the skip_codes (e.g. a trace function) together
+    with the frames they call, such as the event handlers it runs."""
+
+    def __init__(self, interval=0.005, stop_codes=(), skip_codes=()):
+        self.interval = interval
+        self.stop_codes = set(stop_codes)
+        self.skip_codes = set(skip_codes)
+        self.stacks = {}
+        self.samples = 0
+        self.sampling_time = 0.0
+        self.elapsed = 0.0
+        self.thread = None
+        self.timer = None
+        self.running = False
+
+    def start(self):
+        """Start sampling the calling thread."""
+        self.thread = threading.current_thread()
+        self.running = True
+        self.started = time.time()
+        self.timer = threading.Thread(target=self.sample_thread,
+                                      args=(self.thread.ident,))
+        self.timer.daemon = True
+        self.timer.start()
+
+    def stop(self):
+        """Stop sampling."""
+        if not self.running:
+            return
+        self.running = False
+        self.elapsed = time.time() - self.started
+        if self.timer is not threading.current_thread():
+            self.timer.join()
+        self.timer = None
+
+    def sample_thread(self, ident):
+        """Body of the timer thread sampling another thread."""
+        while self.running:
+            time.sleep(self.interval)
+            frame = sys._current_frames().get(ident)
+            if frame is None or not self.running:
+                break
+            self.sample(frame)
+            frame = None
+
+    def sample(self, frame):
+        """Record the stack of frame."""
+        start = time.time()
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            if code in self.stop_codes:
+                break
+            if code in self.skip_codes:
+                stack = []
+            else:
+                stack.append((code.co_filename, code.co_firstlineno,
+                              code.co_name))
+            frame = frame.f_back
+        if stack:
+            stack.reverse()
+            stack = tuple(stack)
+            self.stacks[stack] = self.stacks.get(stack, 0) + 1
+            self.samples = self.samples + 1
+        self.sampling_time = self.sampling_time + time.time() - start
+
+    def collapsed(self):
+        """Return the samples as collapsed stack lines."""
+        lines = []
+        for stack, count in self.stacks.items():
+            names = [frame_name(key).replace(';', ':') for key in stack]
+            lines.append('%s %d\n' % (';'.join(names), count))
+        lines.sort()
+        return lines
+
+    def save(self, path):
+        """Save the samples as collapsed stacks in path."""
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory, 0o700)
+        f = open(path, 'w')
+        try:
+            f.writelines(self.collapsed())
+        finally:
+            f.close()
+
+    def report(self, limit=15):
+        """Return a text report of the hot functions and call paths."""
+        total = self.samples
+        if not total:
+            return 'No samples collected in %.2f s.\n' % self.elapsed
+        own = {}
+        inclusive = {}
+        for stack, count in self.stacks.items():
+            own[stack[-1]] = own.get(stack[-1], 0) + count
+            for key in set(stack):
+                inclusive[key] = inclusive.get(key, 0) + count
+
+        lines = ['%d samples in %.2f s, sampling overhead %.1f%%\n\n' % (
+            total, self.elapsed,
+            100.0 * self.sampling_time / max(self.elapsed, 1e-9))]
+        lines.append('   self%   total%  function\n')
+        hot = sorted(own.items(), key=lambda item: -item[1])[:limit]
+        for key, count in hot:
+            lines.append('%7.1f  %7.1f  %s\n' % (
+                100.0 * count / total, 100.0 * inclusive[key] / total,
+                frame_name(key)))
+
+        lines.append('\n  total%  call path\n')
+        paths = sorted(self.stacks.items(), key=lambda item: -item[1])
+        for stack, count in paths[:limit // 3 or 1]:
+            lines.append('%7.1f  %s\n' % (
+                100.0 * count / total,
+                ' > '.join([key[2] for key in stack])))
+        return ''.join(lines)
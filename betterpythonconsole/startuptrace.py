@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+
+#    This file is part of the Better Python Console Plugin for Gedit
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+"""Timings of the console startup phases, shown with --trace-startup.
+
+The console scripts mark the end of each phase, from their imports to the
+first prompt. Marks are only recorded when --trace-startup is on the
+command line, which is checked when this module is imported so that the
+imports done before the options are parsed are timed too.
+"""
+
+import os
+import sys
+import time
+
+_marks = []
+_active = '--trace-startup' in sys.argv
+
+
+def process_start_time():
+    """Return when this process started, as a time.time() value, or None
+    when it can not be told (only Linux is supported)."""
+    try:
+        f = open('/proc/self/stat')
+        try:
+            stat = f.read()
+        finally:
+            f.close()
+        f = open('/proc/uptime')
+        try:
+            uptime = float(f.read().split()[0])
+        finally:
+            f.close()
+        ticks = os.sysconf('SC_CLK_TCK')
+    except (IOError, OSError, ValueError):
+        return None
+    # The start time is the 22nd field, counting from after the command
+    started = float(stat.rsplit(')', 1)[1].split()[19]) / ticks
+    return time.time() - (uptime - started)
+
+
+def mark(phase):
+    """Record the end of a startup phase, from any thread."""
+    if _active:
+        _marks.append((phase, time.time()))
+
+
+def stop():
+    """Stop recording."""
+    global _active
+    _active = False
+
+
+def report():
+    """Return the duration of each phase and the time since the process
+    started, as text."""
+    if not _marks:
+        return ''
+    start = process_start_time() or _marks[0][1]
+    lines = ['%-20s %9s %9s\n' % ('startup phase', 'ms', 'total')]
+    previous = start
+    for phase, when in _marks:
+        lines.append('%-20s %9.1f %9.1f\n' % (
+            phase, (when - previous) * 1000, (when - start) * 1000))
+        previous = when
+    return ''.join(lines)
+
+
+mark('interpreter')
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+#    This file is part of the Better Python Console Plugin for Gedit
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+"""Incremental statement completeness checking.
+
+Used by the console to tell when a typed or pasted statement is complete,
+and by the plugin to find the statement around the cursor. It only needs
+the standard library, so the gedit process can import it without the
+console engine.
+"""
+
+import re
+
+
+class StatementChecker:
+    """Incremental statement completeness checker.
+
+    Lines are fed one at a time and the tokenizer state (open brackets,
+    open string, backslash continuation) is kept between them, so each
+    line costs time proportional to its own length whatever the size of
+    the statement. Comments, escaped quotes and triple quoted strings are
+    handled the way the Python tokenizer does.
+    """
+
+    code_re = re.compile(r'[#\\\'"()\[\]{}]')
+    string_res = dict((q, re.compile(r'\\|' + q))
+                      for q in ("'", '"', "'''", '"""'))
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Forget about the lines fed so far."""
+        self.depth = 0
+        self.quote = None
+        self.continued = False
+        self.last = ''
+
+    def is_open(self):
+        """Tell whether the lines fed so far end inside a token."""
+        return bool(self.depth or self.quote or self.continued)
+
+    def feed(self, line):
+        """Update the tokenizer state with a new line."""
+        pos = 0
+        n = len(line)
+        code_end = n
+        escaped = False
+        self.continued = False
+        while pos < n:
+            if self.quote:
+                m = self.string_res[self.quote].search(line, pos)
+                if m is None:
+                    break
+                if m.group() == '\\':
+                    escaped = m.end() == n
+                    pos = m.end() + 1
+                else:
+                    self.quote = None
+                    pos = m.end()
+                continue
+            m = self.code_re.search(line, pos)
+            if m is None:
+                break
+            c = m.group()
+            pos = m.end()
+            if c == '#':
+                code_end = m.start()
+                break
+            elif c == '\\':
+                self.continued = pos == n
+            elif c in '"\'':
+                if line.startswith(c * 3, m.start()):
+                    self.quote = c * 3
+                    pos = m.start() + 3
+                else:
+                    self.quote = c
+            elif c in '([{':
+                self.depth = self.depth + 1
+            elif self.depth:
+                self.depth = self.depth - 1
+
+        # A single quoted string only goes on after an escaped newline,
+        # otherwise it is an error which compiling will report
+        if self.quote in ("'", '"') and not escaped:
+            self.quote = None
+        self.last = line[:code_end].rstrip()[-1:]
+
+    def push(self, line):
+        """Feed a line, return True if the statement needs more lines."""
+        self.feed(line)
+        if self.is_open():
+            return True
+        if not line.strip():
+            return False
+        return self.last == ':' or line[0] in ' \t'
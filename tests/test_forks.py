@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+#    This file is part of the Better Python Console Plugin for Gedit
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+"""Worker processes forked by a command, on the headless console.
+
+    python2 -m unittest discover tests
+    python3 -m unittest discover tests
+"""
+
+import os
+import sys
+import time
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CONSOLE_DIR = os.path.join(os.path.dirname(HERE), 'betterpythonconsole')
+sys.path.insert(0, CONSOLE_DIR)
+
+import consolecore
+
+# The pool is started in the run importing multiprocessing
+POOL_COMMAND = '''import multiprocessing, sys
+def work(x):
+    print('worker %d traced %s' % (x, sys.gettrace() is not None))
+    sys.stdout.flush()
+    return x
+pool = multiprocessing.Pool(2)
+print(pool.map(work, range(3)))
+pool.close()
+pool.join()
+'''
+
+
+class Sink:
+    """Output stream keeping what the console writes."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, s):
+        self.chunks.append(s)
+
+    def flush(self):
+        pass
+
+
+class RedirectedConsole(consolecore.HeadlessConsole):
+    """Headless console routing the standard descriptors, like the GTK
+    console does."""
+
+    route_output = True
+
+
+@unittest.skipUnless(hasattr(os, 'fork'), 'needs os.fork')
+class PoolTest(unittest.TestCase):
+
+    def run_pool(self, threaded):
+        sink = Sink()
+        console = RedirectedConsole(consolecore.new_namespace(), sink=sink,
+                                    threaded=threaded)
+        console.execute(POOL_COMMAND)
+        while console.running:
+            console.wait_events()
+        # The output of the workers comes through the redirection thread
+        deadline = time.time() + 5
+        while time.time() < deadline:
+            console.flush_output()
+            if ''.join(sink.chunks).count('worker') == 3:
+                break
+            time.sleep(0.05)
+        return ''.join(sink.chunks)
+
+    def check(self, output):
+        self.assertIn('[0, 1, 2]', output)
+        for x in range(3):
+            self.assertIn('worker %d traced False' % x, output)
+
+    def test_main_thread(self):
+        self.check(self.run_pool(False))
+
+    def test_threaded(self):
+        self.check(self.run_pool(True))
+
+
+if __name__ == '__main__':
+    unittest.main()